@@ -0,0 +1,384 @@
+"""
+Load-test harness for the API, backed by the local LLM stub.
+
+Starts stub_llm and the API under uvicorn, tops the database up to --rows
+traces with datagen.py, then drives each endpoint at a fixed request rate
+(open loop) for --duration seconds. Prints a JSON report with throughput
+and latency percentiles per endpoint, database lock waits and API RSS.
+
+Run:
+    python bench.py --rows 10000 --duration 30 --rate chat=5 --rate create=50 \\
+        --rate list=20 --rate analytics=10 --output bench-10k.json
+
+POST /traces bodies are fresh datagen variations, so by default each one
+misses the classification cache and reaches the stub; --repeat-ratio
+replays earlier bodies to add cache hits, and --local-classify keeps the
+pre-classifier and near-duplicate reuse on.
+
+Lock waits are measured by a probe that takes the write lock every 100 ms
+(BEGIN IMMEDIATE on SQLite) or, on PostgreSQL, by sampling ungranted locks.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+CATEGORIES = ["Billing", "Refund", "Account Access", "Cancellation", "General Inquiry"]
+DEFAULT_RATES = {"chat": 5.0, "create": 20.0, "list": 20.0, "analytics": 10.0}
+PROBE_INTERVAL_S = 0.1
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": round(ordered[-1], 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+    }
+
+
+def _rss_kib(pid: int, field: str = "VmRSS") -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class LockProbe(threading.Thread):
+    """Samples how long a writer has to wait for the database."""
+
+    def __init__(self, database_url: str):
+        super().__init__(daemon=True)
+        self.database_url = database_url
+        self.waits_ms: list[float] = []
+        self.blocked: list[int] = []
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        if self.database_url.startswith("sqlite"):
+            self._probe_sqlite(self.database_url.split("///", 1)[1])
+        else:
+            self._probe_server()
+
+    def _probe_sqlite(self, path: str) -> None:
+        conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        try:
+            while not self._done.wait(PROBE_INTERVAL_S):
+                started = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                self.waits_ms.append((time.perf_counter() - started) * 1000)
+                conn.execute("ROLLBACK")
+        finally:
+            conn.close()
+
+    def _probe_server(self) -> None:
+        from sqlalchemy import text
+
+        from database import engine
+
+        with engine.connect() as conn:
+            while not self._done.wait(PROBE_INTERVAL_S):
+                self.blocked.append(
+                    conn.execute(text("SELECT count(*) FROM pg_locks WHERE NOT granted")).scalar()
+                )
+                conn.rollback()
+
+    def stop(self) -> dict:
+        self._done.set()
+        self.join()
+        if self.blocked:
+            return {
+                "samples": len(self.blocked),
+                "max_waiting_locks": max(self.blocked),
+                "mean_waiting_locks": round(sum(self.blocked) / len(self.blocked), 2),
+            }
+        return {"samples": len(self.waits_ms), "write_lock_wait_ms": _percentiles(self.waits_ms)}
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid: int):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.samples: list[int] = []
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(0.5):
+            rss = _rss_kib(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+
+    def stop(self) -> dict:
+        self._done.set()
+        self.join()
+        peak = _rss_kib(self.pid, "VmHWM")
+        if not self.samples:
+            return {}
+        return {
+            "start_mb": round(self.samples[0] / 1024, 1),
+            "end_mb": round(self.samples[-1] / 1024, 1),
+            "max_mb": round(max(self.samples) / 1024, 1),
+            "peak_mb": round(peak / 1024, 1) if peak else None,
+        }
+
+
+# Earlier bodies kept for --repeat-ratio.
+_HISTORY_SIZE = 1000
+
+
+def _trace_body(rng: random.Random, history: list[dict], repeat_ratio: float) -> dict:
+    """A fresh datagen variation of a seed trace, or (with probability
+    repeat_ratio) an earlier body, which the classification cache answers."""
+    if history and rng.random() < repeat_ratio:
+        return rng.choice(history)
+    from datagen import variation
+
+    trace = variation(rng)
+    body = {name: trace[name] for name in ("user_message", "bot_response", "response_time_ms")}
+    if len(history) < _HISTORY_SIZE:
+        history.append(body)
+    return body
+
+
+def _request(name: str, rng: random.Random, async_classify: bool, history: list[dict], repeat_ratio: float):
+    if name == "chat":
+        return "POST", "/chat", {"message": _trace_body(rng, history, repeat_ratio)["user_message"]}
+    if name == "create":
+        path = "/traces?async_classify=true" if async_classify else "/traces"
+        return "POST", path, _trace_body(rng, history, repeat_ratio)
+    if name == "list":
+        return "GET", "/traces", None, {"category": rng.choice(CATEGORIES), "preview": 120}
+    if name == "analytics":
+        return "GET", "/analytics", None
+    raise ValueError(f"Unknown endpoint: {name}")
+
+
+class Driver:
+    """Issues requests at a fixed rate per endpoint and records the outcome."""
+
+    def __init__(
+        self,
+        base_url: str,
+        rates: dict[str, float],
+        concurrency: int,
+        async_classify: bool,
+        repeat_ratio: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.base_url = base_url
+        self.rates = rates
+        self.concurrency = concurrency
+        self.async_classify = async_classify
+        self.repeat_ratio = repeat_ratio
+        # Cached classifications persist, so reusing a seed replays cache hits.
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.latencies: dict[str, list[float]] = {name: [] for name in rates}
+        self.errors: dict[str, dict[str, int]] = {name: {} for name in rates}
+        self.dropped: dict[str, int] = {name: 0 for name in rates}
+        self._in_flight = 0
+
+    async def run(self, duration_s: float) -> float:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=60) as client:
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(self._schedule(client, name, rate, started, duration_s) for name, rate in self.rates.items())
+            )
+            return time.perf_counter() - started
+
+    async def _schedule(self, client, name: str, rate: float, started: float, duration_s: float) -> None:
+        rng = random.Random(f"{self.seed}:{name}")
+        history: list[dict] = []
+        tasks = []
+        for i in range(int(rate * duration_s)):
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._in_flight >= self.concurrency:
+                self.dropped[name] += 1
+                continue
+            request = _request(name, rng, self.async_classify, history, self.repeat_ratio)
+            tasks.append(asyncio.create_task(self._send(client, name, request)))
+        await asyncio.gather(*tasks)
+
+    async def _send(self, client, name: str, request: tuple) -> None:
+        method, path, body, *params = request
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body, params=params[0] if params else None)
+            outcome = None if response.status_code < 400 else str(response.status_code)
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        finally:
+            self._in_flight -= 1
+        if outcome is None:
+            self.latencies[name].append((time.perf_counter() - started) * 1000)
+        else:
+            self.errors[name][outcome] = self.errors[name].get(outcome, 0) + 1
+
+    def report(self, elapsed_s: float) -> dict:
+        endpoints = {}
+        for name, rate in self.rates.items():
+            ok = len(self.latencies[name])
+            failed = sum(self.errors[name].values())
+            endpoints[name] = {
+                "target_rps": rate,
+                "requests": ok + failed,
+                "ok": ok,
+                "errors": self.errors[name],
+                "dropped": self.dropped[name],
+                "throughput_rps": round(ok / elapsed_s, 2),
+                "latency_ms": _percentiles(self.latencies[name]),
+            }
+        return endpoints
+
+
+def _spawn(args: list[str], env: dict, port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", *args, "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout_s: float = 600) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout_s}s")
+
+
+def _parse_rates(values: list[str] | None) -> dict[str, float]:
+    if not values:
+        return dict(DEFAULT_RATES)
+    rates = {}
+    for value in values:
+        name, _, rate = value.partition("=")
+        if name not in DEFAULT_RATES:
+            raise SystemExit(f"Unknown endpoint {name!r}; choose from {', '.join(DEFAULT_RATES)}")
+        rates[name] = float(rate)
+    return rates
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the SupportLens API against the LLM stub.")
+    parser.add_argument("--database-url", help="Defaults to sqlite:///./bench-<rows>.db")
+    parser.add_argument("--rows", type=int, default=10000, help="Pre-populate the database to this many traces")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to drive load")
+    parser.add_argument("--rate", action="append", metavar="ENDPOINT=RPS",
+                        help="Requests per second for chat, create, list or analytics (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=256, help="Maximum requests in flight")
+    parser.add_argument("--async-classify", action="store_true", help="Create traces as Pending (202)")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0,
+                        help="Fraction of chat/create bodies that repeat an earlier one (classification cache hits)")
+    parser.add_argument("--local-classify", action="store_true",
+                        help="Keep the pre-classifier and near-duplicate reuse on, so fewer creates reach the stub")
+    parser.add_argument("--seed", type=int, help="Seed for request bodies (random by default)")
+    parser.add_argument("--stub-latency-ms", type=float, default=300)
+    parser.add_argument("--stub-jitter-ms", type=float, default=100)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--api-port", type=int, default=8100)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///./bench-{args.rows}.db"
+    if database_url.startswith("sqlite:///") and not database_url.startswith("sqlite:////"):
+        # The API runs from this directory; resolve the path against the caller's.
+        database_url = "sqlite:///" + os.path.abspath(database_url[len("sqlite:///"):])
+    os.environ["DATABASE_URL"] = database_url
+    import datagen  # reads DATABASE_URL on import
+
+    existing = datagen.row_count()
+    if existing < args.rows:
+        print(f"Generating {args.rows - existing} traces...", file=sys.stderr)
+        datagen.populate(args.rows - existing, seed=existing)
+
+    stub = _spawn(["stub_llm:app"], {
+        "STUB_LATENCY_MS": str(args.stub_latency_ms),
+        "STUB_JITTER_MS": str(args.stub_jitter_ms),
+        "STUB_ERROR_RATE": str(args.stub_error_rate),
+    }, args.stub_port)
+    api = _spawn(["main:app"], {
+        "DATABASE_URL": database_url,
+        "GROQ_BASE_URL": f"http://127.0.0.1:{args.stub_port}",
+        **({} if args.local_classify else {"PREFILTER_ENABLED": "0", "NEAR_DUPLICATE_THRESHOLD": "0"}),
+    }, args.api_port)
+    base_url = f"http://127.0.0.1:{args.api_port}"
+    try:
+        _wait_ready(f"http://127.0.0.1:{args.stub_port}/docs", stub)
+        _wait_ready(f"{base_url}/classification/status", api)
+
+        rates = _parse_rates(args.rate)
+        driver = Driver(base_url, rates, args.concurrency, args.async_classify, args.repeat_ratio, args.seed)
+        probe = LockProbe(database_url)
+        rss = RssSampler(api.pid)
+        probe.start()
+        rss.start()
+        started_at = datetime.now(timezone.utc)
+        elapsed = asyncio.run(driver.run(args.duration))
+        report = {
+            "started_at": started_at.isoformat(),
+            "database": {"url": database_url, "rows": datagen.row_count()},
+            "config": {
+                "duration_s": args.duration,
+                "concurrency": args.concurrency,
+                "async_classify": args.async_classify,
+                "repeat_ratio": args.repeat_ratio,
+                "local_classify": args.local_classify,
+                "seed": driver.seed,
+                "stub": {
+                    "latency_ms": args.stub_latency_ms,
+                    "jitter_ms": args.stub_jitter_ms,
+                    "error_rate": args.stub_error_rate,
+                },
+            },
+            "elapsed_s": round(elapsed, 2),
+            "endpoints": driver.report(elapsed),
+            "lock_waits": probe.stop(),
+            "api_rss": rss.stop(),
+        }
+    finally:
+        for process in (api, stub):
+            process.terminate()
+            process.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
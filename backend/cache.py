@@ -0,0 +1,173 @@
+"""
+Content-addressed cache for trace classifications.
+
+Keys hash the normalized conversation (or just the user message) together
+with a fingerprint of MODEL and CLASSIFICATION_PROMPT, so editing either
+invalidates every entry. Lookups go through a bounded in-memory LRU and
+then, optionally, the classification_cache table.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import llm
+from database import SessionLocal
+from models import Category, ClassificationCacheEntry
+
+MAX_ENTRIES = int(os.environ.get("CLASSIFY_CACHE_SIZE", "10000"))
+# "conversation" keys on (user_message, bot_response); "message" on user_message alone.
+KEY_MODE = os.environ.get("CLASSIFY_CACHE_KEY", "conversation")
+PERSIST = os.environ.get("CLASSIFY_CACHE_PERSIST", "1") == "1"
+
+FINGERPRINT = hashlib.sha256(
+    f"{llm.MODEL}\0{llm.CLASSIFICATION_PROMPT}".encode()
+).hexdigest()[:16]
+
+_WHITESPACE = re.compile(r"\s+")
+# Rows per INSERT statement; keeps bound parameters under SQLite's limit.
+_ROWS_PER_STATEMENT = 500
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+class ClassificationCache:
+    def __init__(
+        self,
+        max_entries: int = MAX_ENTRIES,
+        key_mode: str = KEY_MODE,
+        persist: bool = PERSIST,
+    ):
+        if key_mode not in ("conversation", "message"):
+            raise ValueError(f"Invalid cache key mode: {key_mode}")
+        self.max_entries = max_entries
+        self.key_mode = key_mode
+        self.persist = persist
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, Category] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, user_message: str, bot_response: str) -> str:
+        parts = [FINGERPRINT, self.key_mode, _normalize(user_message)]
+        if self.key_mode == "conversation":
+            parts.append(_normalize(bot_response))
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> Category | None:
+        with self._lock:
+            category = self._entries.get(key)
+            if category is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return category
+
+        if self.persist:
+            category = self._load(key)
+            if category is not None:
+                self._remember(key, category)
+                with self._lock:
+                    self.persistent_hits += 1
+                return category
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, category: Category) -> None:
+        self.put_many({key: category})
+
+    def put_many(self, entries: dict[str, Category]) -> None:
+        """Cache several classifications, persisting them in one transaction."""
+        for key, category in entries.items():
+            self._remember(key, category)
+        if self.persist and entries:
+            self._store(entries)
+
+    def purge_stale(self) -> int:
+        """Delete persisted entries written under another prompt/model version."""
+        if not self.persist:
+            return 0
+        db = SessionLocal()
+        try:
+            deleted = (
+                db.query(ClassificationCacheEntry)
+                .filter(ClassificationCacheEntry.fingerprint != FINGERPRINT)
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remember(self, key: str, category: Category) -> None:
+        with self._lock:
+            self._entries[key] = category
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _load(self, key: str) -> Category | None:
+        db = SessionLocal()
+        try:
+            return (
+                db.query(ClassificationCacheEntry.category)
+                .filter(ClassificationCacheEntry.key == key)
+                .scalar()
+            )
+        finally:
+            db.close()
+
+    def _store(self, entries: dict[str, Category]) -> None:
+        now = datetime.utcnow()
+        rows = [
+            {"key": key, "fingerprint": FINGERPRINT, "category": category, "created_at": now}
+            for key, category in entries.items()
+        ]
+        db = SessionLocal()
+        try:
+            dialect = db.get_bind().dialect.name
+            if dialect in ("sqlite", "postgresql"):
+                insert = sqlite_insert if dialect == "sqlite" else pg_insert
+                for i in range(0, len(rows), _ROWS_PER_STATEMENT):
+                    stmt = insert(ClassificationCacheEntry).values(rows[i : i + _ROWS_PER_STATEMENT])
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["key"],
+                        set_={
+                            "fingerprint": stmt.excluded.fingerprint,
+                            "category": stmt.excluded.category,
+                            "created_at": stmt.excluded.created_at,
+                        },
+                    )
+                    db.execute(stmt)
+            else:
+                for row in rows:
+                    db.merge(ClassificationCacheEntry(**row))
+            db.commit()
+        finally:
+            db.close()
+
+
+cache = ClassificationCache()
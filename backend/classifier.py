@@ -0,0 +1,77 @@
+"""
+Trace classification front door: consults the classification cache, already
+classified near-duplicates (see vectors.py) and the local pre-classifier
+before paying for an LLM call. Endpoints and the background pipeline call
+this module rather than llm.classify directly.
+"""
+
+import asyncio
+
+import llm
+import metrics
+from cache import cache
+from models import Category, LabelSource
+from prefilter import prefilter
+from vectors import index as vector_index
+
+
+def _resolve_locally(
+    key: str, user_message: str, bot_response: str
+) -> tuple[Category, LabelSource] | None:
+    category = cache.get(key)
+    if category is not None:
+        return category, LabelSource.CACHE
+    category = vector_index.near_duplicate(user_message)
+    if category is not None:
+        return category, LabelSource.NEAR_DUPLICATE
+    category = prefilter.predict(user_message, bot_response)
+    if category is not None:
+        return category, LabelSource.PREFILTER
+    return None
+
+
+async def classify(user_message: str, bot_response: str) -> tuple[Category, LabelSource]:
+    """Return the category and the stage that decided it (Trace.classified_by)."""
+    key = cache.key(user_message, bot_response)
+    # The cache's persistent tier and the model are blocking; keep them off the loop.
+    with metrics.span("classify.local"):
+        label = await asyncio.to_thread(_resolve_locally, key, user_message, bot_response)
+    if label is None:
+        category = Category(await llm.classify(user_message, bot_response))
+        await asyncio.to_thread(cache.put, key, category)
+        label = category, LabelSource.LLM
+    return label
+
+
+def _resolve_many(keys: list[str], pairs: list[tuple[str, str]]):
+    results: dict[str, tuple[Category, LabelSource]] = {}
+    misses: dict[str, tuple[str, str]] = {}
+    for key, pair in zip(keys, pairs):
+        if key in results or key in misses:
+            continue
+        label = _resolve_locally(key, *pair)
+        if label is None:
+            misses[key] = pair
+        else:
+            results[key] = label
+    return results, misses
+
+
+async def classify_many(pairs: list[tuple[str, str]]) -> list[tuple[Category, LabelSource]]:
+    """Classify many conversations, sending only distinct unresolved ones to the LLM.
+
+    Returns (category, stage) per pair, as classify does.
+    """
+    keys = [cache.key(user_message, bot_response) for user_message, bot_response in pairs]
+    with metrics.span("classify.local"):
+        results, misses = await asyncio.to_thread(_resolve_many, keys, pairs)
+
+    if misses:
+        labels = await llm.classify_batch(list(misses.values()))
+        classified = {key: Category(label) for key, label in zip(misses, labels)}
+        await asyncio.to_thread(cache.put_many, classified)
+        results.update(
+            (key, (category, LabelSource.LLM)) for key, category in classified.items()
+        )
+
+    return [results[key] for key in keys]
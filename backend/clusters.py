@@ -0,0 +1,164 @@
+"""
+Periodic clustering of recent traces into issue groups.
+
+Every CLUSTER_INTERVAL_S the clusterer runs spherical k-means over the
+embeddings of traces from the last CLUSTER_WINDOW_HOURS (the newest
+CLUSTER_MAX_TRACES of them). Each group is compared with the preceding
+CLUSTER_BASELINE_DAYS: its baseline is how many traces per window
+length fell near its centroid (similarity at least CLUSTER_SIMILARITY)
+back then. Groups are ranked by growth over that baseline, so a new issue
+surfaces even while it hides inside a coarse Category.
+"""
+
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+
+import schemas
+import vectors
+from database import SessionLocal
+from models import Trace
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_INTERVAL_S = float(os.environ.get("CLUSTER_INTERVAL_S", "900"))
+CLUSTER_WINDOW_HOURS = float(os.environ.get("CLUSTER_WINDOW_HOURS", "24"))
+CLUSTER_BASELINE_DAYS = float(os.environ.get("CLUSTER_BASELINE_DAYS", "7"))
+CLUSTER_MAX_TRACES = int(os.environ.get("CLUSTER_MAX_TRACES", "20000"))
+CLUSTER_MIN_SIZE = int(os.environ.get("CLUSTER_MIN_SIZE", "5"))
+CLUSTER_SIMILARITY = float(os.environ.get("CLUSTER_SIMILARITY", "0.6"))
+CLUSTER_LIMIT = int(os.environ.get("CLUSTER_LIMIT", "20"))
+
+_EXAMPLES = 3
+
+
+def _embeddings(db, start: datetime, end: datetime):
+    """(rows, unit vectors, total matching) for the newest traces in [start, end)."""
+    query = db.query(Trace.id, Trace.user_message, Trace.category, Trace.embedding).filter(
+        Trace.timestamp >= start, Trace.timestamp < end, Trace.embedding.is_not(None)
+    )
+    rows = query.order_by(Trace.timestamp.desc()).limit(CLUSTER_MAX_TRACES).all()
+    total = len(rows)
+    if total == CLUSTER_MAX_TRACES:
+        total = query.count()
+    matrix = np.frombuffer(b"".join(row.embedding for row in rows), dtype=np.int8)
+    return rows, vectors.as_unit(matrix.reshape(-1, vectors.EMBEDDING_DIM)), total
+
+
+def build(now: Optional[datetime] = None) -> schemas.ClusterReport:
+    """Cluster the current window and compare each group with the baseline."""
+    now = now or datetime.utcnow()
+    window = timedelta(hours=CLUSTER_WINDOW_HOURS)
+    db = SessionLocal()
+    try:
+        rows, points, total = _embeddings(db, now - window, now)
+        _, baseline, baseline_total = _embeddings(
+            db, now - window - timedelta(days=CLUSTER_BASELINE_DAYS), now - window
+        )
+    finally:
+        db.close()
+
+    clusters = []
+    if len(rows) >= CLUSTER_MIN_SIZE:
+        k = int(min(200, max(1, np.sqrt(len(rows) / 2))))
+        centroids, assignment = vectors.kmeans(points, k)
+        similarity = np.minimum(1.0, np.einsum("ij,ij->i", points, centroids[assignment]))
+
+        # Baseline traces close to a centroid, scaled to one window of all traces.
+        expected = np.zeros(len(centroids))
+        if len(baseline):
+            scores = baseline @ centroids.T
+            nearest = np.argmax(scores, axis=1)
+            close = scores[np.arange(len(baseline)), nearest] >= CLUSTER_SIMILARITY
+            expected = np.bincount(nearest[close], minlength=len(centroids)).astype(float)
+            expected *= (baseline_total / len(baseline)) * (
+                CLUSTER_WINDOW_HOURS / (CLUSTER_BASELINE_DAYS * 24)
+            )
+        scale = total / len(rows)
+
+        for cluster in range(len(centroids)):
+            members = np.nonzero((assignment == cluster) & (similarity >= CLUSTER_SIMILARITY))[0]
+            if len(members) < CLUSTER_MIN_SIZE:
+                continue
+            members = members[np.argsort(similarity[members])[::-1]]
+            examples = []
+            for i in members:
+                if rows[i].user_message not in examples:
+                    examples.append(rows[i].user_message)
+                if len(examples) == _EXAMPLES:
+                    break
+            size = round(len(members) * scale)
+            clusters.append(
+                schemas.IssueCluster(
+                    representative=rows[members[0]].user_message,
+                    examples=examples,
+                    size=size,
+                    baseline=round(float(expected[cluster]), 1),
+                    growth=round((size + 1) / (float(expected[cluster]) + 1), 2),
+                    cohesion=round(float(similarity[members].mean()), 3),
+                    categories=dict(Counter(rows[i].category.value for i in members)),
+                )
+            )
+    clusters.sort(key=lambda c: (c.growth, c.size), reverse=True)
+    return schemas.ClusterReport(
+        generated_at=now,
+        window_hours=CLUSTER_WINDOW_HOURS,
+        baseline_days=CLUSTER_BASELINE_DAYS,
+        traces=total,
+        clusters=clusters[:CLUSTER_LIMIT],
+    )
+
+
+class Clusterer:
+    """Rebuilds the cluster report every CLUSTER_INTERVAL_S (0 disables it)."""
+
+    def __init__(self):
+        self.latest: schemas.ClusterReport | None = None
+        self.runs = 0
+        self.failed_runs = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if CLUSTER_INTERVAL_S > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def refresh(self) -> schemas.ClusterReport:
+        self.latest = await asyncio.to_thread(build)
+        self.runs += 1
+        return self.latest
+
+    async def _loop(self) -> None:
+        # Embeddings of older traces may still be backfilling until then.
+        while not vectors.index.ready:
+            await asyncio.sleep(1)
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed_runs += 1
+                logger.exception("Clustering failed")
+            await asyncio.sleep(CLUSTER_INTERVAL_S)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "clusters": len(self.latest.clusters) if self.latest else 0,
+        }
+
+
+clusterer = Clusterer()
@@ -0,0 +1,102 @@
+"""
+Generate synthetic traces from the seed.py templates, for load tests.
+
+Each trace is a seed template with randomized amounts, ids and phrasing,
+a timestamp spread over the last --days days and a jittered response time.
+Rows are written in batches through ingest.write, so rollups stay in step.
+
+Run:
+    DATABASE_URL=sqlite:///./bench.db python datagen.py 1000000
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from database import SessionLocal, engine, init_db
+import ingest
+import search
+from models import Trace
+from seed import SEED_TRACES
+
+BATCH = 10000
+
+_NUMBER = re.compile(r"\d+")
+_OPENERS = ["", "", "Hi, ", "Hello, ", "Hey there, ", "Quick question: ", "Urgent: "]
+_CLOSERS = ["", "", " Thanks!", " Thank you.", " Please help.", " Any update?"]
+
+
+def _vary(text: str, rng: random.Random) -> str:
+    # Keep the number of digits so invoice ids and amounts still look real.
+    return _NUMBER.sub(lambda m: str(rng.randrange(10 ** (len(m.group()) - 1), 10 ** len(m.group()))), text)
+
+
+def variation(rng: random.Random) -> dict:
+    """A random seed template with new amounts, ids, phrasing and response time."""
+    template = rng.choice(SEED_TRACES)
+    return {
+        "user_message": rng.choice(_OPENERS) + _vary(template["user_message"], rng) + rng.choice(_CLOSERS),
+        "bot_response": _vary(template["bot_response"], rng),
+        "category": template["category"],
+        "response_time_ms": max(50, int(template["response_time_ms"] * rng.lognormvariate(0, 0.35))),
+    }
+
+
+def generate(count: int, days: int = 90, seed: int | None = None):
+    """Yield lists of up to BATCH unsaved traces, `count` in total."""
+    rng = random.Random(seed)
+    end = datetime.utcnow()
+    span_s = days * 86400
+    while count > 0:
+        batch = []
+        for _ in range(min(BATCH, count)):
+            batch.append(
+                Trace(
+                    id=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                    timestamp=end - timedelta(seconds=rng.uniform(0, span_s)),
+                    time_to_first_token_ms=None,
+                    **variation(rng),
+                )
+            )
+        count -= len(batch)
+        yield batch
+
+
+def populate(count: int, days: int = 90, seed: int | None = None) -> int:
+    """Insert `count` generated traces; returns the number written."""
+    init_db()
+    search.install(engine)
+    written = 0
+    db = SessionLocal()
+    try:
+        for batch in generate(count, days, seed):
+            ingest.write(db, batch)
+            written += len(batch)
+    finally:
+        db.close()
+    return written
+
+
+def row_count() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(Trace).count()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("rows", type=int, help="Traces to add")
+    parser.add_argument("--days", type=int, default=90, help="Spread timestamps over this many days")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible data")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    written = populate(args.rows, args.days, args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Generated {written} traces in {elapsed:.1f}s ({written / elapsed:.0f}/s).", file=sys.stderr)
@@ -0,0 +1,170 @@
+"""
+In-process pub/sub that pushes trace and analytics changes to dashboards.
+
+GET /events streams these as server-sent events. Event ids are
+"<epoch>-<seq>"; a reconnecting client sends its last id back and receives
+the events it missed from a bounded history, or a `resync` event telling it
+to refetch when they are gone (or the server restarted). A subscriber whose
+queue fills up is likewise switched to `resync` instead of slowing publishers.
+Analytics events carry the traces version (the /analytics ETag) of the write
+they describe.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from collections import deque
+from dataclasses import dataclass
+
+import schemas
+from models import Category
+
+HISTORY_SIZE = int(os.environ.get("EVENTS_HISTORY_SIZE", "1000"))
+QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "256"))
+
+
+@dataclass
+class Event:
+    id: str
+    seq: int
+    type: str
+    data: dict
+
+    def sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class Subscriber:
+    def __init__(self, broker: "EventBroker", queue_size: int):
+        self._broker = broker
+        self._queue: asyncio.Queue[Event] = asyncio.Queue(maxsize=queue_size)
+        self.lagging = False
+
+    def offer(self, event: Event) -> None:
+        if self.lagging:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop its backlog and have it refetch.
+            self.lagging = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(self._broker.resync_event())
+
+    async def get(self) -> Event:
+        event = await self._queue.get()
+        if event.type == "resync":
+            self.lagging = False
+            # Stamp with the latest id so a later resume doesn't replay
+            # events the refetch already covers.
+            return self._broker.resync_event()
+        return event
+
+
+class EventBroker:
+    def __init__(self, history_size: int = HISTORY_SIZE, queue_size: int = QUEUE_SIZE):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._seq = 0
+        self._history: deque[Event] = deque(maxlen=history_size)
+        self._subscribers: set[Subscriber] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+    def publish(self, event_type: str, data: dict) -> None:
+        """Publish an event. Safe to call from threadpool code; a no-op
+        outside the server (e.g. in CLI scripts)."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._publish(event_type, data)
+        else:
+            self._loop.call_soon_threadsafe(self._publish, event_type, data)
+
+    def _publish(self, event_type: str, data: dict) -> None:
+        self._seq += 1
+        event = Event(f"{self.epoch}-{self._seq}", self._seq, event_type, data)
+        self._history.append(event)
+        for subscriber in self._subscribers:
+            subscriber.offer(event)
+
+    def resync_event(self) -> Event:
+        return Event(f"{self.epoch}-{self._seq}", self._seq, "resync", {})
+
+    def subscribe(self, last_event_id: str | None = None) -> Subscriber:
+        """Register a subscriber, replaying anything missed since last_event_id."""
+        subscriber = Subscriber(self, self.queue_size)
+        if last_event_id:
+            missed = self._missed_since(last_event_id)
+            if missed is None or len(missed) >= self.queue_size:
+                subscriber.offer(self.resync_event())
+            else:
+                for event in missed:
+                    subscriber.offer(event)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+    def _missed_since(self, last_event_id: str) -> list[Event] | None:
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._history[0].seq if self._history else self._seq + 1
+        if seq < oldest - 1:
+            return None
+        return [event for event in self._history if event.seq > seq]
+
+
+broker = EventBroker()
+
+
+def _analytics_delta(rows: list[tuple[Category, int, int]], version: int) -> dict:
+    deltas: dict[Category, list[int]] = {}
+    for category, count, latency_ms in rows:
+        delta = deltas.setdefault(category, [0, 0])
+        delta[0] += count
+        delta[1] += count * latency_ms
+    return {
+        "version": version,
+        "deltas": [
+            {"category": category.value, "count": count, "latency_sum_ms": latency_sum}
+            for category, (count, latency_sum) in deltas.items()
+        ]
+    }
+
+
+def publish_created(traces: list[schemas.TraceResponse], version: int) -> None:
+    """Announce newly stored traces and their effect on /analytics totals."""
+    if not traces:
+        return
+    for trace in traces:
+        broker.publish("trace", trace.model_dump(mode="json"))
+    broker.publish(
+        "analytics",
+        _analytics_delta([(t.category, 1, t.response_time_ms) for t in traces], version),
+    )
+
+
+def publish_reclassified(
+    trace_id: str, old: Category, new: Category, response_time_ms: int, version: int
+) -> None:
+    broker.publish("trace_updated", {"id": trace_id, "category": new.value})
+    broker.publish(
+        "analytics",
+        _analytics_delta([(old, -1, response_time_ms), (new, 1, response_time_ms)], version),
+    )
@@ -0,0 +1,184 @@
+"""
+Streaming export of traces as NDJSON, CSV, Parquet or Arrow IPC.
+
+Rows are read through a server-side cursor in batches of EXPORT_BATCH_SIZE
+and encoded one batch at a time, so memory stays flat regardless of how
+many traces are exported. Parquet and Arrow need the optional `pyarrow`
+package.
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import Category, Trace
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pq = None
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "5000"))
+
+COLUMNS = [
+    "id",
+    "user_message",
+    "bot_response",
+    "category",
+    "timestamp",
+    "response_time_ms",
+    "time_to_first_token_ms",
+]
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+COLUMNAR_FORMATS = {"parquet", "arrow"}
+
+
+def available(fmt: str) -> bool:
+    return fmt not in COLUMNAR_FORMATS or pa is not None
+
+
+def _batches(
+    category: Optional[Category], start: Optional[datetime], end: Optional[datetime]
+) -> Iterator[list[tuple]]:
+    """Yield lists of rows in (timestamp, id) order from a server-side cursor."""
+    stmt = select(*(getattr(Trace, name) for name in COLUMNS))
+    if category is not None:
+        stmt = stmt.where(Trace.category == category)
+    if start is not None:
+        stmt = stmt.where(Trace.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(Trace.timestamp < end)
+    stmt = stmt.order_by(Trace.timestamp, Trace.id).execution_options(
+        yield_per=EXPORT_BATCH_SIZE
+    )
+
+    db = SessionLocal()
+    try:
+        for partition in db.execute(stmt).partitions():
+            yield [
+                (row[0], row[1], row[2], row[3].value, *row[4:]) for row in partition
+            ]
+    finally:
+        db.close()
+
+
+def _ndjson(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    for batch in batches:
+        lines = []
+        for row in batch:
+            record = dict(zip(COLUMNS, row))
+            record["timestamp"] = record["timestamp"].isoformat()
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def _csv(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in batches:
+        writer.writerows(
+            (*row[:4], row[4].isoformat(), *row[5:]) for row in batch
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _arrow_schema():
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("user_message", pa.string()),
+            ("bot_response", pa.string()),
+            ("category", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+            ("response_time_ms", pa.int32()),
+            ("time_to_first_token_ms", pa.int32()),
+        ]
+    )
+
+
+def _record_batch(batch: list[tuple], schema):
+    columns = list(zip(*batch)) if batch else [[] for _ in COLUMNS]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands its contents to the response on drain()."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    schema = _arrow_schema()
+    sink = _Sink()
+    # One row group per fetched batch.
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_batch(_record_batch(batch, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _arrow(batches: Iterator[list[tuple]]) -> Iterator[bytes]:
+    schema = _arrow_schema()
+    sink = _Sink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(_record_batch(batch, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+_ENCODERS = {"ndjson": _ndjson, "csv": _csv, "parquet": _parquet, "arrow": _arrow}
+
+
+def stream(
+    fmt: str,
+    category: Optional[Category] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Iterator[bytes]:
+    """Encode the matching traces in the given format, one batch at a time."""
+    for chunk in _ENCODERS[fmt](_batches(category, start, end)):
+        if chunk:
+            yield chunk
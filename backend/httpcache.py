@@ -0,0 +1,187 @@
+"""
+HTTP caching for the read endpoints.
+
+Every write to `traces` bumps a version counter in the same transaction.
+GET /traces and /analytics use it as a weak ETag (answering If-None-Match
+with 304) and as the validity key of a small in-process cache of encoded,
+pre-compressed response bodies. Writes made by this process invalidate
+the cache at once; writes from other processes are noticed within
+HTTP_CACHE_VERSION_TTL_S. Analytics events pushed to dashboards carry the
+version of their write, so a client can tell which ones an /analytics
+response (read with snapshot()) already counts.
+"""
+
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import brotli
+from fastapi import Request, Response
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+import metrics
+from models import TableVersion
+
+VERSION_TTL_S = float(os.environ.get("HTTP_CACHE_VERSION_TTL_S", "1"))
+MAX_ENTRIES = int(os.environ.get("HTTP_CACHE_SIZE", "256"))
+COMPRESS_MIN_BYTES = int(os.environ.get("HTTP_COMPRESS_MIN_BYTES", "1024"))
+
+TRACES = "traces"
+
+
+def bump(db: Session, name: str = TRACES) -> int:
+    """Advance a table's version and return it. Call inside the write transaction."""
+    updated = (
+        db.query(TableVersion)
+        .filter(TableVersion.name == name)
+        .update(
+            {TableVersion.version: TableVersion.version + 1, TableVersion.updated_at: datetime.utcnow()},
+            synchronize_session=False,
+        )
+    )
+    if not updated:
+        db.add(TableVersion(name=name, version=1))
+        return 1
+    return db.query(TableVersion.version).filter(TableVersion.name == name).scalar()
+
+
+def snapshot(db: Session) -> int:
+    """Start a read-only snapshot in `db` and return the traces version it
+    sees; rows read next in the session are exactly those of that version."""
+    db.rollback()
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        # pysqlite runs SELECTs outside a transaction unless one is opened.
+        db.connection().exec_driver_sql("BEGIN")
+    elif dialect == "postgresql":
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    return db.query(TableVersion.version).filter(TableVersion.name == TRACES).scalar() or 0
+
+
+def _accepted_encoding(request: Request) -> str | None:
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in request.headers.get("accept-encoding", "").split(",")
+    }
+    for encoding in ("br", "gzip"):
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class _Entry:
+    def __init__(self, version: int, body: bytes):
+        self.version = version
+        self.body = body
+        self.encoded: dict[str, bytes] = {}
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, version_ttl_s: float = VERSION_TTL_S):
+        self.max_entries = max_entries
+        self.version_ttl_s = version_ttl_s
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._version: int | None = None
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+
+    def version(self, db: Session) -> int:
+        with self._lock:
+            if self._version is not None and time.monotonic() - self._version_checked < self.version_ttl_s:
+                return self._version
+        version = (
+            db.query(TableVersion.version).filter(TableVersion.name == TRACES).scalar() or 0
+        )
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+            self._version = version
+            self._version_checked = time.monotonic()
+        return version
+
+    def invalidate(self) -> None:
+        """Forget cached bodies and the cached version after a local write."""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def lookup(self, request: Request, db: Session) -> tuple[int, Response | None]:
+        """Return (version, response); response is a 304 or a cached body, or
+        None if the caller must build it and pass it to store()."""
+        version = self.version(db)
+        etag = _etag(version)
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+            with self._lock:
+                self.not_modified += 1
+            return version, Response(status_code=304, headers=_headers(etag))
+
+        with self._lock:
+            entry = self._entries.get(_key(request))
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return version, None
+            self._entries.move_to_end(_key(request))
+            self.hits += 1
+        return version, self._respond(request, entry)
+
+    def store(self, request: Request, version: int, payload: BaseModel) -> Response:
+        with metrics.span("serialize"):
+            entry = _Entry(version, payload.model_dump_json().encode())
+        with self._lock:
+            if self._version == version:
+                self._entries[_key(request)] = entry
+                self._entries.move_to_end(_key(request))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return self._respond(request, entry)
+
+    def _respond(self, request: Request, entry: _Entry) -> Response:
+        headers = _headers(_etag(entry.version))
+        encoding = _accepted_encoding(request) if len(entry.body) >= COMPRESS_MIN_BYTES else None
+        if encoding is None:
+            return Response(entry.body, media_type="application/json", headers=headers)
+        body = entry.encoded.get(encoding)
+        if body is None:
+            # Compressed once per cached entry, then reused.
+            with metrics.span("compress"):
+                body = entry.encoded[encoding] = _compress(entry.body, encoding)
+        headers["Content-Encoding"] = encoding
+        return Response(body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "not_modified": self.not_modified,
+                "misses": self.misses,
+            }
+
+
+def _key(request: Request) -> str:
+    return f"{request.url.path}?{request.url.query}"
+
+
+def _etag(version: int) -> str:
+    return f'W/"{version}"'
+
+
+def _headers(etag: str) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+
+response_cache = ResponseCache()
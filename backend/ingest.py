@@ -0,0 +1,214 @@
+"""
+Write-behind ingest buffer with group commit.
+
+Endpoints hand new traces to IngestBuffer.add(); a single flusher task
+collects them for up to INGEST_FLUSH_MS (or INGEST_BATCH_SIZE traces) and
+writes each batch with multi-row INSERTs in one transaction, so one commit
+(and one fsync) covers many traces. After commit it publishes the traces
+to /events and hands pending ones to the classification queue. If a batch
+fails, it is split and retried so only the request holding the bad row fails.
+
+INGEST_DURABILITY picks when add() returns:
+  commit   - after the batch holding the traces has committed (default)
+  buffered - immediately; traces still in memory are lost if the process
+             dies before the next flush
+"""
+
+import asyncio
+import logging
+import os
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import events
+import httpcache
+import metrics
+import rollups
+import schemas
+import vectors
+from database import SessionLocal
+from models import Category, Trace
+from pipeline import queue as classification_queue
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "500"))
+FLUSH_MS = float(os.environ.get("INGEST_FLUSH_MS", "5"))
+MAX_PENDING = int(os.environ.get("INGEST_MAX_PENDING", "10000"))
+DURABILITY = os.environ.get("INGEST_DURABILITY", "commit")
+
+# Rows per INSERT statement; keeps bound parameters under SQLite's limit.
+_ROWS_PER_STATEMENT = 500
+_COLUMNS = [column.name for column in Trace.__table__.columns]
+
+
+def write(db: Session, traces: list[Trace]) -> int:
+    """Insert traces, with their embeddings and rollup deltas, in one transaction.
+
+    Returns the traces version of the commit (see httpcache.py).
+    """
+    with metrics.span("ingest.embed"):
+        for trace in traces:
+            if trace.embedding is None:
+                trace.embedding = vectors.to_bytes(vectors.encode(trace.user_message))
+    rows = [{name: getattr(trace, name) for name in _COLUMNS} for trace in traces]
+    with metrics.span("ingest.insert"):
+        for i in range(0, len(rows), _ROWS_PER_STATEMENT):
+            db.execute(insert(Trace).values(rows[i : i + _ROWS_PER_STATEMENT]))
+        rollups.record(db, traces)
+        version = httpcache.bump(db)
+    with metrics.span("db.commit"):
+        db.commit()
+    httpcache.response_cache.invalidate()
+    vectors.index.add_traces(traces)
+    return version
+
+
+def _write_batch(traces: list[Trace]) -> int:
+    db = SessionLocal()
+    try:
+        return write(db, traces)
+    finally:
+        db.close()
+
+
+class _Pending:
+    def __init__(self, traces: list[Trace], created: list[schemas.TraceResponse], future):
+        self.traces = traces
+        self.created = created
+        self.future = future
+
+
+class IngestBuffer:
+    """Accumulates traces in memory and group-commits them from one task."""
+
+    def __init__(
+        self,
+        batch_size: int = BATCH_SIZE,
+        flush_ms: float = FLUSH_MS,
+        durability: str = DURABILITY,
+    ):
+        if durability not in ("commit", "buffered"):
+            raise ValueError(f"Unknown INGEST_DURABILITY: {durability}")
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.durability = durability
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self._pending: list[_Pending] = []
+        self._buffered = 0
+        self._wakeup: asyncio.Event | None = None
+        self._drained: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    @property
+    def buffered(self) -> int:
+        """Traces accepted but not yet committed."""
+        return self._buffered
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._stopping = False
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self) -> None:
+        """Flush everything still buffered, then stop the flusher."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def add(self, traces: list[Trace]) -> list[schemas.TraceResponse]:
+        """Queue traces for writing and return their responses, built from the
+        in-memory objects. Waits for the commit unless durability is buffered."""
+        if self._task is None or self._stopping:
+            raise RuntimeError("IngestBuffer is not running")
+        created = [schemas.TraceResponse.model_validate(trace) for trace in traces]
+        while self._buffered >= MAX_PENDING:
+            await self._drained.wait()
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Pending(traces, created, future))
+        self._buffered += len(traces)
+        self._drained.clear()
+        self._wakeup.set()
+        if self.durability == "commit":
+            with metrics.span("ingest.wait"):
+                await future
+        return created
+
+    def _take(self) -> list[_Pending]:
+        taken, size = [], 0
+        while self._pending and (not taken or size + len(self._pending[0].traces) <= self.batch_size):
+            item = self._pending.pop(0)
+            taken.append(item)
+            size += len(item.traces)
+        return taken
+
+    async def _flusher(self) -> None:
+        while not self._stopping:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Give concurrent requests a moment to join this batch.
+            if self._buffered < self.batch_size and self.flush_ms > 0 and not self._stopping:
+                await asyncio.sleep(self.flush_ms / 1000)
+            while self._pending:
+                await self._flush(self._take())
+
+    async def _flush(self, batch: list[_Pending]) -> None:
+        metrics.BATCH_SIZE.labels("ingest.flush").observe(sum(len(item.traces) for item in batch))
+        try:
+            await self._write(batch)
+        finally:
+            self._buffered -= sum(len(item.traces) for item in batch)
+            if not self._pending:
+                self._drained.set()
+
+    async def _write(self, batch: list[_Pending]) -> None:
+        traces = [trace for item in batch for trace in item.traces]
+        try:
+            version = await asyncio.to_thread(_write_batch, traces)
+        except Exception as e:
+            if len(batch) > 1:
+                # Bisect, so one bad request doesn't fail the others sharing
+                # its commit; each request's traces stay in one transaction.
+                half = len(batch) // 2
+                await self._write(batch[:half])
+                await self._write(batch[half:])
+                return
+            self.failed += len(traces)
+            logger.exception("Failed to write %d buffered traces", len(traces))
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+                    # Nobody awaits the future in buffered mode.
+                    item.future.exception()
+        else:
+            self.flushes += 1
+            self.written += len(traces)
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(None)
+            events.publish_created([c for item in batch for c in item.created], version)
+            for trace in traces:
+                if trace.category == Category.PENDING:
+                    classification_queue.submit(trace.id)
+
+    def stats(self) -> dict:
+        return {
+            "durability": self.durability,
+            "buffered": self._buffered,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+
+buffer = IngestBuffer()
@@ -1,9 +1,50 @@
+import asyncio
 import os
+import random
+import re
 import time
 
-from groq import Groq
+import httpx
+import metrics
+from groq import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncGroq,
+    InternalServerError,
+    RateLimitError,
+)
 
-client = Groq(api_key=os.environ.get("GROQ_API_KEY", ""))
+# Point at a local stand-in for the Groq API (see stub_llm.py) when set.
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL") or None
+
+# Seconds before a single LLM request is abandoned.
+LLM_TIMEOUT_S = float(os.environ.get("LLM_TIMEOUT_S", "30"))
+# Upper bound on LLM requests in flight across the whole process.
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "200"))
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE_S = float(os.environ.get("LLM_BACKOFF_BASE_S", "0.5"))
+LLM_BACKOFF_MAX_S = float(os.environ.get("LLM_BACKOFF_MAX_S", "20"))
+
+# One keep-alive connection pool shared by every call.
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=LLM_MAX_CONCURRENCY,
+        max_keepalive_connections=min(LLM_MAX_CONCURRENCY, 100),
+        keepalive_expiry=60,
+    ),
+    timeout=LLM_TIMEOUT_S,
+)
+
+client = AsyncGroq(
+    # A stand-in API needs no key, but an empty one fails every request.
+    api_key=os.environ.get("GROQ_API_KEY") or ("unused" if GROQ_BASE_URL else ""),
+    base_url=GROQ_BASE_URL,
+    timeout=LLM_TIMEOUT_S,
+    # Retries are handled by _with_retries so they share the concurrency limit.
+    max_retries=0,
+    http_client=http_client,
+)
 
 MODEL = "llama-3.1-8b-instant"
 
@@ -21,9 +62,7 @@ Guidelines:
 - If you cannot directly resolve an issue (e.g., process a refund), explain the steps or escalation path
 - Never make up specific account details — acknowledge you'd need to verify identity for account-specific actions"""
 
-CLASSIFICATION_PROMPT = """You are a support ticket classifier. Classify the following customer support conversation into exactly one category.
-
-Categories:
+CLASSIFICATION_GUIDE = """Categories:
 - Billing: Questions about invoices, charges, payment methods, pricing, or subscription fees
 - Refund: Requests to return a product, get money back, dispute a charge, or process a credit
 - Account Access: Issues logging in, resetting passwords, locked accounts, or MFA problems
@@ -35,7 +74,11 @@ Classification rules:
 2. Refund vs Billing: if the customer wants money back (not just asking about a charge), use Refund
 3. Cancellation vs Billing: if the customer wants to cancel (not just asking about pricing), use Cancellation
 4. Account Access vs General Inquiry: if the issue is logging in or authentication, use Account Access
-5. When genuinely ambiguous, prefer the more specific category over General Inquiry
+5. When genuinely ambiguous, prefer the more specific category over General Inquiry"""
+
+CLASSIFICATION_PROMPT = """You are a support ticket classifier. Classify the following customer support conversation into exactly one category.
+
+""" + CLASSIFICATION_GUIDE + """
 
 Customer Message:
 {user_message}
@@ -45,35 +88,241 @@ Support Response:
 
 Respond with ONLY the category name. No explanation, no punctuation — just the exact category name from the list above."""
 
+BATCH_CLASSIFICATION_PROMPT = """You are a support ticket classifier. Classify each of the following {count} customer support conversations into exactly one category.
+
+""" + CLASSIFICATION_GUIDE + """
+
+{conversations}
+
+Respond with exactly {count} lines, one per conversation, in the form "<number>: <category>" (for example "1: Billing"). No explanation — just the numbered category names from the list above."""
+
+BATCH_ITEM_TEMPLATE = """### Conversation {number}
+Customer Message:
+{user_message}
+
+Support Response:
+{bot_response}"""
+
+# Conversations packed into one batch classification request.
+BATCH_SIZE = int(os.environ.get("CLASSIFY_BATCH_SIZE", "20"))
+
+VALID_CATEGORIES = ["Billing", "Refund", "Account Access", "Cancellation", "General Inquiry"]
+
+_BATCH_LINE = re.compile(r"^\s*(\d+)\s*[:.)\-]\s*(.+?)\s*$")
+
+
+_RETRYABLE = (RateLimitError, InternalServerError, APIConnectionError, APITimeoutError)
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed call might succeed later (429s, 5xx, connection errors)."""
+    return isinstance(error, _RETRYABLE)
+
+_semaphore: asyncio.Semaphore | None = None
+_semaphore_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _limiter() -> asyncio.Semaphore:
+    """The concurrency limiter for the running event loop."""
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _semaphore_loop = loop
+    return _semaphore
+
+
+def _retry_after(error: Exception) -> float | None:
+    """Seconds the server asked us to wait, from Retry-After(-Ms) headers."""
+    if not isinstance(error, APIStatusError):
+        return None
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
 
-def chat(user_message: str) -> tuple[str, int]:
+
+def _backoff(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, never shorter than Retry-After."""
+    backoff = random.uniform(0, min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_BASE_S * 2**attempt))
+    return max(backoff, _retry_after(error) or 0)
+
+
+def _record_error(call: str, error: Exception) -> None:
+    name = str(error.status_code) if isinstance(error, APIStatusError) else type(error).__name__
+    metrics.LLM_ERRORS.labels(call, name).inc()
+
+
+async def _with_retries(name: str, call):
+    """Await call() under the concurrency limit, retrying transient failures.
+
+    name labels the call's metrics (see metrics.py).
+    """
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        try:
+            with metrics.span("llm.limiter_wait"):
+                await _limiter().acquire()
+            try:
+                response = await call()
+            finally:
+                _limiter().release()
+            metrics.record_usage(name, response)
+            return response
+        except _RETRYABLE as e:
+            _record_error(name, e)
+            if attempt == LLM_MAX_ATTEMPTS - 1:
+                raise
+            metrics.LLM_RETRIES.labels(name).inc()
+            await asyncio.sleep(_backoff(attempt, e))
+        except Exception as e:
+            _record_error(name, e)
+            raise
+
+
+def _chat_messages(user_message: str) -> list[dict]:
+    return [
+        {"role": "system", "content": CHATBOT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+
+
+async def chat(user_message: str) -> tuple[str, int]:
     start = time.time()
-    response = client.chat.completions.create(
-        model=MODEL,
-        max_tokens=512,
-        messages=[
-            {"role": "system", "content": CHATBOT_SYSTEM_PROMPT},
-            {"role": "user", "content": user_message},
-        ],
-    )
+    with metrics.span("llm.chat"):
+        response = await _with_retries(
+            "chat",
+            lambda: client.chat.completions.create(
+                model=MODEL, max_tokens=512, messages=_chat_messages(user_message)
+            ),
+        )
     elapsed_ms = int((time.time() - start) * 1000)
     return response.choices[0].message.content, elapsed_ms
 
 
-def classify(user_message: str, bot_response: str) -> str:
+async def chat_stream(user_message: str):
+    """Yield the chatbot response as it is generated, one text delta at a time.
+
+    Holds a concurrency slot until the stream is exhausted or closed; only
+    opening the stream is retried.
+    """
+    async with _limiter():
+        stream = None
+        started = time.perf_counter()
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            try:
+                stream = await client.chat.completions.create(
+                    model=MODEL,
+                    max_tokens=512,
+                    messages=_chat_messages(user_message),
+                    stream=True,
+                )
+                break
+            except _RETRYABLE as e:
+                _record_error("chat_stream", e)
+                if attempt == LLM_MAX_ATTEMPTS - 1:
+                    raise
+                metrics.LLM_RETRIES.labels("chat_stream").inc()
+                await asyncio.sleep(_backoff(attempt, e))
+            except Exception as e:
+                _record_error("chat_stream", e)
+                raise
+        first = True
+        try:
+            async for chunk in stream:
+                if first:
+                    metrics.STAGE_LATENCY.labels("llm.chat_stream.first_token").observe(
+                        time.perf_counter() - started
+                    )
+                    first = False
+                # Groq reports usage on the final chunk, under x_groq.
+                metrics.record_usage("chat_stream", getattr(chunk, "x_groq", None) or chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Returns the pooled connection now, also when the client went away.
+            await stream.close()
+        metrics.STAGE_LATENCY.labels("llm.chat_stream").observe(time.perf_counter() - started)
+
+
+async def classify(user_message: str, bot_response: str) -> str:
     prompt = CLASSIFICATION_PROMPT.format(
         user_message=user_message, bot_response=bot_response
     )
-    response = client.chat.completions.create(
-        model=MODEL,
-        max_tokens=10,
-        messages=[{"role": "user", "content": prompt}],
-    )
+    with metrics.span("llm.classify"):
+        response = await _with_retries(
+            "classify",
+            lambda: client.chat.completions.create(
+                model=MODEL,
+                max_tokens=10,
+                messages=[{"role": "user", "content": prompt}],
+            ),
+        )
     raw = response.choices[0].message.content.strip()
+    return _match_category(raw) or "General Inquiry"
+
+
+async def classify_batch(pairs: list[tuple[str, str]]) -> list[str]:
+    """Classify (user_message, bot_response) pairs, BATCH_SIZE per request.
+
+    Chunks are sent concurrently. Items whose label can't be parsed from the
+    batch reply are re-sent individually through classify().
+    """
+    chunks = await asyncio.gather(
+        *(
+            _classify_chunk(pairs[start : start + BATCH_SIZE])
+            for start in range(0, len(pairs), BATCH_SIZE)
+        )
+    )
+    return [label for chunk in chunks for label in chunk]
+
+
+async def _classify_chunk(pairs: list[tuple[str, str]]) -> list[str]:
+    if len(pairs) == 1:
+        return [await classify(*pairs[0])]
 
-    valid = ["Billing", "Refund", "Account Access", "Cancellation", "General Inquiry"]
-    for cat in valid:
+    conversations = "\n\n".join(
+        BATCH_ITEM_TEMPLATE.format(
+            number=i, user_message=user_message, bot_response=bot_response
+        )
+        for i, (user_message, bot_response) in enumerate(pairs, start=1)
+    )
+    prompt = BATCH_CLASSIFICATION_PROMPT.format(
+        count=len(pairs), conversations=conversations
+    )
+    metrics.BATCH_SIZE.labels("llm.classify_batch").observe(len(pairs))
+    with metrics.span("llm.classify_batch"):
+        response = await _with_retries(
+            "classify_batch",
+            lambda: client.chat.completions.create(
+                model=MODEL,
+                max_tokens=8 * len(pairs) + 16,
+                messages=[{"role": "user", "content": prompt}],
+            ),
+        )
+    raw = response.choices[0].message.content or ""
+
+    parsed: dict[int, str] = {}
+    for line in raw.splitlines():
+        match = _BATCH_LINE.match(line)
+        if match:
+            category = _match_category(match.group(2))
+            if category:
+                parsed.setdefault(int(match.group(1)), category)
+
+    missing = [i for i in range(1, len(pairs) + 1) if i not in parsed]
+    if missing:
+        labels = await asyncio.gather(*(classify(*pairs[i - 1]) for i in missing))
+        parsed.update(zip(missing, labels))
+    return [parsed[i] for i in range(1, len(pairs) + 1)]
+
+
+def _match_category(raw: str) -> str | None:
+    for cat in VALID_CATEGORIES:
         if cat.lower() in raw.lower():
             return cat
-
-    return "General Inquiry"
+    return None
@@ -1,29 +1,85 @@
+import asyncio
+import base64
+import json
+import time
 import uuid
 from contextlib import asynccontextmanager
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Literal, Optional
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import func
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, tuple_
 from sqlalchemy.orm import Session
 
+import classifier
+import clusters
+import events
+import export
+import httpcache
+import ingest
 import llm
+import metrics
+import retention
+import rollups
 import schemas
-from database import Base, engine, get_db
-from models import Category, Trace
+import search
+import vectors
+from sketch import LatencySketch
+from cache import cache as classification_cache
+from pipeline import queue as classification_queue
+from prefilter import prefilter
+from database import engine, get_db, init_db
+from models import ArchivePartition, Category, Trace
 
-Base.metadata.create_all(bind=engine)
+init_db()
+search.install(engine)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     from seed import seed
+    rollups.ensure_built()
     seed()
+    classification_cache.purge_stale()
+    prefilter.start()
+    events.broker.start()
+    await classification_queue.start()
+    await ingest.buffer.start()
+    vectors.index.start()
+    clusters.clusterer.start()
+    retention.archiver.start()
+    metrics.register(
+        engine,
+        ingest=ingest.buffer.stats,
+        classification_cache=classification_cache.stats,
+        prefilter=prefilter.stats,
+        response_cache=httpcache.response_cache.stats,
+        classification_queue=lambda: {
+            "backlog": classification_queue.backlog,
+            "in_flight": classification_queue.in_flight,
+            "classified": classification_queue.classified,
+            "retries": classification_queue.retries,
+            "failed": classification_queue.failed,
+        },
+        events=lambda: {"subscribers": events.broker.subscribers},
+        retention=retention.archiver.stats,
+        vectors=vectors.index.stats,
+        clusters=clusters.clusterer.stats,
+    )
+    metrics.start_profiler()
     yield
+    metrics.stop_profiler()
+    await retention.archiver.stop()
+    await clusters.clusterer.stop()
+    await vectors.index.stop()
+    await ingest.buffer.stop()
+    await classification_queue.stop()
+    await llm.http_client.aclose()
 
 
 app = FastAPI(title="SupportLens API", version="1.0.0", lifespan=lifespan)
@@ -35,85 +91,542 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.post("/chat", response_model=schemas.ChatResponse)
-def chat_endpoint(request: schemas.ChatRequest):
+async def chat_endpoint(request: schemas.ChatRequest):
     """Generate a chatbot response for a user message."""
     try:
-        response_text, response_time_ms = llm.chat(request.message)
+        response_text, response_time_ms = await llm.chat(request.message)
         return {"response": response_text, "response_time_ms": response_time_ms}
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"LLM error: {str(e)}")
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(
+    request: schemas.ChatRequest,
+    persist: bool = Query(
+        False, description="Save the finished conversation as a trace (classified in the background)"
+    ),
+):
+    """Stream a chatbot response as server-sent events.
+
+    Emits `token` events with text deltas, then one `done` event carrying the
+    full response, total time and time to first token (plus `trace_id` when
+    persisted), or an `error` event if generation fails.
+    """
+
+    async def stream():
+        start = time.perf_counter()
+        first_token_ms = None
+        parts = []
+        try:
+            async for token in llm.chat_stream(request.message):
+                if first_token_ms is None:
+                    first_token_ms = int((time.perf_counter() - start) * 1000)
+                parts.append(token)
+                yield _sse("token", {"token": token})
+        except Exception as e:
+            yield _sse("error", {"detail": f"LLM error: {str(e)}"})
+            return
+
+        response_text = "".join(parts)
+        done = {
+            "response": response_text,
+            "response_time_ms": int((time.perf_counter() - start) * 1000),
+            "time_to_first_token_ms": first_token_ms,
+        }
+        if persist:
+            trace_id = str(uuid.uuid4())
+            db_trace = Trace(
+                id=trace_id,
+                user_message=request.message,
+                bot_response=response_text,
+                category=Category.PENDING,
+                timestamp=datetime.utcnow(),
+                response_time_ms=done["response_time_ms"],
+                time_to_first_token_ms=first_token_ms,
+            )
+            try:
+                await ingest.buffer.add([db_trace])
+            except Exception as e:
+                yield _sse("error", {"detail": f"Failed to save trace: {str(e)}"})
+                return
+            done["trace_id"] = trace_id
+        yield _sse("done", done)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/traces", response_model=schemas.TraceResponse, status_code=201)
-def create_trace(trace: schemas.TraceCreate, db: Session = Depends(get_db)):
-    """Receive a trace, classify it via LLM, save and return it."""
-    try:
-        category_str = llm.classify(trace.user_message, trace.bot_response)
-        category = Category(category_str)
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"Classification error: {str(e)}")
+async def create_trace(
+    trace: schemas.TraceCreate,
+    response: Response,
+    async_classify: bool = Query(
+        False, description="Store as Pending and classify in the background (202)"
+    ),
+):
+    """Receive a trace, classify it via LLM, save and return it.
+
+    Writes are group-committed with concurrent requests (see ingest.py).
+    """
+    if async_classify:
+        category, classified_by = Category.PENDING, None
+    else:
+        try:
+            category, classified_by = await classifier.classify(
+                trace.user_message, trace.bot_response
+            )
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Classification error: {str(e)}")
 
     db_trace = Trace(
         id=str(uuid.uuid4()),
         user_message=trace.user_message,
         bot_response=trace.bot_response,
         category=category,
+        classified_by=classified_by,
         timestamp=datetime.utcnow(),
         response_time_ms=trace.response_time_ms,
+        time_to_first_token_ms=trace.time_to_first_token_ms,
+    )
+    try:
+        (created,) = await ingest.buffer.add([db_trace])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save trace: {str(e)}")
+    if async_classify:
+        response.status_code = 202
+    return created
+
+
+MAX_BULK_TRACES = 1000
+
+
+@app.post("/traces/bulk", response_model=list[schemas.TraceResponse], status_code=201)
+async def create_traces_bulk(
+    traces: list[schemas.TraceCreate],
+    response: Response,
+    async_classify: bool = Query(
+        False, description="Store as Pending and classify in the background (202)"
+    ),
+):
+    """Classify a list of traces in batched LLM calls and save them in one transaction."""
+    if len(traces) > MAX_BULK_TRACES:
+        raise HTTPException(
+            status_code=413, detail=f"At most {MAX_BULK_TRACES} traces per request"
+        )
+
+    if async_classify:
+        labels = [(Category.PENDING, None)] * len(traces)
+    else:
+        try:
+            labels = await classifier.classify_many(
+                [(t.user_message, t.bot_response) for t in traces]
+            )
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Classification error: {str(e)}")
+
+    now = datetime.utcnow()
+    db_traces = [
+        Trace(
+            id=str(uuid.uuid4()),
+            user_message=trace.user_message,
+            bot_response=trace.bot_response,
+            category=category,
+            classified_by=classified_by,
+            timestamp=now,
+            response_time_ms=trace.response_time_ms,
+            time_to_first_token_ms=trace.time_to_first_token_ms,
+        )
+        for trace, (category, classified_by) in zip(traces, labels)
+    ]
+    try:
+        result = await ingest.buffer.add(db_traces)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save traces: {str(e)}")
+    if async_classify:
+        response.status_code = 202
+    return result
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Stored timestamps are naive UTC; convert offset-aware bounds to match."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@app.get("/traces/export")
+def export_traces(
+    format: Literal["ndjson", "csv", "parquet", "arrow"] = Query(
+        "ndjson", description="Output format; parquet and arrow need pyarrow"
+    ),
+    category: Optional[str] = Query(None, description="Filter by category name"),
+    start: Optional[datetime] = Query(None, description="Only traces at or after this time (UTC)"),
+    end: Optional[datetime] = Query(None, description="Only traces before this time (UTC)"),
+):
+    """Stream every matching trace, oldest first, without buffering the result set."""
+    cat_enum = None
+    if category:
+        try:
+            cat_enum = Category(category)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid category: {category}")
+    if not export.available(format):
+        raise HTTPException(status_code=501, detail=f"{format} export requires pyarrow")
+
+    media_type, extension = export.FORMATS[format]
+    return StreamingResponse(
+        export.stream(format, cat_enum, _naive_utc(start), _naive_utc(end)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="traces.{extension}"'},
     )
-    db.add(db_trace)
-    db.commit()
-    db.refresh(db_trace)
-    return db_trace
 
 
-@app.get("/traces", response_model=list[schemas.TraceResponse])
+@app.get("/archive", response_model=list[schemas.ArchivePartitionInfo])
+def list_archive_partitions(db: Session = Depends(get_db)):
+    """List the monthly archives written by the retention task."""
+    return db.query(ArchivePartition).order_by(ArchivePartition.month).all()
+
+
+@app.get("/archive/traces")
+def read_archived_traces(
+    category: Optional[str] = Query(None, description="Filter by category name"),
+    start: Optional[datetime] = Query(None, description="Only traces at or after this time (UTC)"),
+    end: Optional[datetime] = Query(None, description="Only traces before this time (UTC)"),
+    limit: Optional[int] = Query(None, ge=1, description="Stop after this many traces"),
+):
+    """Stream archived traces as NDJSON, oldest month first.
+
+    Only months overlapping [start, end) are decompressed.
+    """
+    cat_enum = None
+    if category:
+        try:
+            cat_enum = Category(category)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid category: {category}")
+    return StreamingResponse(
+        retention.stream_ndjson(cat_enum, _naive_utc(start), _naive_utc(end), limit),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get("/traces/{trace_id}/similar", response_model=list[schemas.SimilarTrace])
+def get_similar_traces(
+    trace_id: str,
+    limit: int = Query(10, ge=1, le=100, description="Maximum traces to return"),
+    db: Session = Depends(get_db),
+):
+    """Return the traces whose user_message is most similar to this trace's,
+    most similar first.
+
+    Answered from the in-memory vector index (see vectors.py), so results
+    are approximate. Archived traces are left out.
+    """
+    if not vectors.index.ready:
+        raise HTTPException(status_code=503, detail="Vector index is still loading")
+    row = db.query(Trace.user_message, Trace.embedding).filter(Trace.id == trace_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    if row.embedding is not None:
+        vector = vectors.from_bytes(row.embedding)
+    else:
+        vector = vectors.encode(row.user_message)
+
+    # Spare matches cover traces archived by another process, which this
+    # process's index still holds.
+    with metrics.span("vectors.search"):
+        matches = vectors.index.search(vector, k=2 * limit + 1)
+    similarity = {match_id: score for match_id, _, score in matches if match_id != trace_id}
+    rows = db.query(
+        Trace.id,
+        Trace.user_message,
+        Trace.bot_response,
+        Trace.category,
+        Trace.timestamp,
+        Trace.response_time_ms,
+        Trace.time_to_first_token_ms,
+    ).filter(Trace.id.in_(list(similarity)))
+    by_id = {r.id: r for r in rows}
+    return [
+        schemas.SimilarTrace(**by_id[match_id]._mapping, similarity=round(score, 4))
+        for match_id, score in similarity.items()
+        if match_id in by_id
+    ][:limit]
+
+
+@app.get("/clusters", response_model=schemas.ClusterReport)
+async def get_clusters(
+    refresh: bool = Query(False, description="Recluster now instead of returning the last report"),
+):
+    """Return groups of similar recent traces, fastest-growing first (see clusters.py)."""
+    if refresh or clusters.clusterer.latest is None:
+        return await clusters.clusterer.refresh()
+    return clusters.clusterer.latest
+
+
+EVENTS_HEARTBEAT_S = 15
+
+
+@app.get("/events")
+async def stream_events(
+    last_event_id: Optional[str] = Query(
+        None, description="Resume after this event id (EventSource sends Last-Event-ID itself)"
+    ),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """Push new traces, classification updates and analytics deltas as server-sent events.
+
+    Event types: `trace` (a new trace), `trace_updated` ({id, category}),
+    `analytics` ({deltas: [{category, count, latency_sum_ms}]}) and `resync`
+    (missed events are unavailable; refetch /traces and /analytics).
+    """
+    subscriber = events.broker.subscribe(last_event_id_header or last_event_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), EVENTS_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield event.sse()
+        finally:
+            events.broker.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _encode_cursor(timestamp: datetime, trace_id: str) -> str:
+    raw = f"{timestamp.isoformat()}|{trace_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, trace_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), trace_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Relevance-ordered search results page by offset rather than by key.
+def _encode_offset_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"@{offset}".encode()).decode()
+
+
+def _decode_offset_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        if not raw.startswith("@"):
+            raise ValueError(raw)
+        offset = int(raw[1:])
+        if offset < 0:
+            raise ValueError(raw)
+        return offset
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/traces", response_model=schemas.TracePage)
 def get_traces(
+    request: Request,
     category: Optional[str] = Query(None, description="Filter by category name"),
+    q: Optional[str] = Query(
+        None, max_length=500, description="Full-text search over user_message and bot_response"
+    ),
+    sort: Optional[Literal["recent", "relevance"]] = Query(
+        None, description="Ordering; defaults to relevance when q is given, else recent"
+    ),
+    limit: int = Query(50, ge=1, le=500, description="Maximum traces per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    preview: Optional[int] = Query(
+        None, ge=0, le=2000, description="Truncate message bodies to this many characters"
+    ),
     db: Session = Depends(get_db),
 ):
-    """Return all traces, most recent first. Optionally filter by category."""
-    query = db.query(Trace).order_by(Trace.timestamp.desc())
+    """Return one page of traces, most recent first. Optionally filter by category
+    and full-text search.
+
+    Pages are keyed on (timestamp, id) so each one is an index range scan.
+    Search results carry a score and a highlighted snippet. Responses carry an
+    ETag and are cached until the next trace write (see httpcache.py).
+    """
+    version, cached = httpcache.response_cache.lookup(request, db)
+    if cached is not None:
+        return cached
+
+    if preview is None:
+        columns = [Trace.user_message, Trace.bot_response]
+    else:
+        # Truncate in SQL so full bodies never leave the database.
+        columns = [
+            func.substr(Trace.user_message, 1, preview).label("user_message"),
+            func.substr(Trace.bot_response, 1, preview).label("bot_response"),
+        ]
+    query = db.query(
+        Trace.id,
+        *columns,
+        Trace.category,
+        Trace.timestamp,
+        Trace.response_time_ms,
+        Trace.time_to_first_token_ms,
+    )
+    where = []
     if category:
         try:
             cat_enum = Category(category)
         except ValueError:
             raise HTTPException(status_code=400, detail=f"Invalid category: {category}")
-        query = query.filter(Trace.category == cat_enum)
-    return query.all()
+        where.append(Trace.category == cat_enum)
+
+    by_relevance = q is not None and sort != "recent"
+    if sort == "relevance" and q is None:
+        raise HTTPException(status_code=400, detail="sort=relevance requires q")
+    offset = 0
+    if by_relevance and cursor:
+        offset = _decode_offset_cursor(cursor)
+    elif cursor:
+        where.append(tuple_(Trace.timestamp, Trace.id) < _decode_cursor(cursor))
+
+    if q is not None:
+        try:
+            query, score, snippet = search.apply(
+                query,
+                q,
+                db.get_bind().dialect.name,
+                by_relevance=by_relevance,
+                where=where,
+                offset=offset,
+                limit=limit + 1,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.add_columns(score.label("score"), snippet.label("snippet"))
+    else:
+        query = query.filter(*where).order_by(Trace.timestamp.desc(), Trace.id.desc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if by_relevance:
+            next_cursor = _encode_offset_cursor(offset + limit)
+        else:
+            next_cursor = _encode_cursor(rows[-1].timestamp, rows[-1].id)
+    page = schemas.TracePage(items=rows, next_cursor=next_cursor)
+    return httpcache.response_cache.store(request, version, page)
 
 
 @app.get("/analytics", response_model=schemas.Analytics)
-def get_analytics(db: Session = Depends(get_db)):
-    """Return aggregate statistics across all traces."""
-    total = db.query(Trace).count()
+def get_analytics(
+    request: Request,
+    start: Optional[datetime] = Query(None, description="Only traces at or after this time (UTC)"),
+    end: Optional[datetime] = Query(None, description="Only traces before this time (UTC)"),
+    db: Session = Depends(get_db),
+):
+    """Return aggregate statistics, answered from the hourly/daily rollups.
+
+    start and end are widened to whole hours. Responses carry an ETag and
+    are cached until the next trace write (see httpcache.py).
+    """
+    version, cached = httpcache.response_cache.lookup(request, db)
+    if cached is not None:
+        return cached
+    # The ETag must name exactly the writes these rollups include, so the
+    # dashboard can skip pushed deltas it already has.
+    version = httpcache.snapshot(db)
+
+    start, end = _naive_utc(start), _naive_utc(end)
+    summary = rollups.summarize(db, start, end)
+    total = sum(count for count, _ in summary.values())
     if total == 0:
-        return schemas.Analytics(
+        empty = schemas.Analytics(
             total_traces=0, by_category=[], avg_response_time_ms=0.0
         )
+        return httpcache.response_cache.store(request, version, empty)
 
-    category_counts = (
-        db.query(Trace.category, func.count(Trace.id).label("count"))
-        .group_by(Trace.category)
-        .all()
-    )
+    latency_sum = sum(latency for _, latency in summary.values())
+    avg_time = latency_sum / total
 
-    avg_time = db.query(func.avg(Trace.response_time_ms)).scalar() or 0.0
+    sketches = rollups.latency_sketches(db, start, end)
+    overall = LatencySketch()
+    for sketch in sketches.values():
+        overall.merge(sketch)
 
+    # Percentages are over classified traces; pending ones are reported apart.
+    pending = summary.get(Category.PENDING, (0, 0))[0]
+    classified = total - pending
     by_category = [
         schemas.CategoryStat(
             category=cat.value,
             count=count,
-            percentage=round(count / total * 100, 1),
+            percentage=round(count / classified * 100, 1),
+            latency=_percentiles(sketches[cat]) if cat in sketches else None,
         )
-        for cat, count in category_counts
+        for cat, (count, _) in sorted(summary.items(), key=lambda item: item[0].value)
+        if cat != Category.PENDING
     ]
 
-    return schemas.Analytics(
+    analytics = schemas.Analytics(
         total_traces=total,
         by_category=by_category,
         avg_response_time_ms=round(avg_time, 1),
+        pending_traces=pending,
+        latency=_percentiles(overall),
+        latency_histogram=[
+            schemas.HistogramBucket(le_ms=edge, count=count)
+            for edge, count in overall.histogram()
+        ],
+    )
+    return httpcache.response_cache.store(request, version, analytics)
+
+
+def _percentiles(sketch: LatencySketch) -> schemas.LatencyPercentiles:
+    return schemas.LatencyPercentiles(
+        p50=round(sketch.quantile(0.50), 1),
+        p95=round(sketch.quantile(0.95), 1),
+        p99=round(sketch.quantile(0.99), 1),
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint."""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+
+@app.get("/classification/status", response_model=schemas.ClassificationStatus)
+def get_classification_status(db: Session = Depends(get_db)):
+    """Report the background classification backlog."""
+    pending = db.query(Trace).filter(Trace.category == Category.PENDING).count()
+    return schemas.ClassificationStatus(
+        pending_traces=pending,
+        backlog=classification_queue.backlog,
+        in_flight=classification_queue.in_flight,
+        workers=classification_queue.workers,
+        classified=classification_queue.classified,
+        retries=classification_queue.retries,
+        failed=classification_queue.failed,
+        cache=classification_cache.stats(),
+        prefilter=prefilter.stats(),
     )
@@ -0,0 +1,249 @@
+"""
+Prometheus metrics, per-stage timing and an opt-in sampling profiler.
+
+MetricsMiddleware times every request by route template. span() times a
+stage inside a request (LLM calls, the DB session, statements, commits,
+serialization). Both feed histograms served at GET /metrics, alongside LLM
+token and error counters, DB pool gauges and in-process queue sizes.
+
+With PROFILE_SLOW_MS set, a background thread samples every thread's stack
+each PROFILE_INTERVAL_MS, and requests slower than the threshold have the
+samples taken during them written to PROFILE_DIR as collapsed stacks
+(one "frame;frame;frame count" line per stack, ready for flamegraph.pl or
+speedscope). Samples cover all threads, so concurrent requests show up too.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as Tally, deque
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "10"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./profiles")
+
+_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+)
+
+REQUEST_LATENCY = Histogram(
+    "supportlens_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ["method", "route", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "supportlens_stage_duration_seconds",
+    "Time spent in one stage of request handling.",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "supportlens_llm_tokens_total",
+    "LLM tokens reported by the API.",
+    ["call", "kind"],
+)
+LLM_ERRORS = Counter(
+    "supportlens_llm_errors_total",
+    "Failed LLM requests, including ones that were retried.",
+    ["call", "error"],
+)
+LLM_RETRIES = Counter(
+    "supportlens_llm_retries_total",
+    "LLM requests retried after a transient failure.",
+    ["call"],
+)
+BATCH_SIZE = Histogram(
+    "supportlens_batch_size",
+    "Items handled per batched operation.",
+    ["operation"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000),
+)
+
+# Streaming responses that stay open indefinitely are not timed.
+_UNTIMED_ROUTES = {"/events", "/metrics"}
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block of work under the given stage label."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - started)
+
+
+def record_usage(call: str, response) -> None:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    LLM_TOKENS.labels(call, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(call, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def instrument_engine(engine) -> None:
+    """Time every statement executed through the engine."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is not None:
+            STAGE_LATENCY.labels("db.execute").observe(time.perf_counter() - started)
+
+
+class _StateCollector:
+    """Gauges read at scrape time from the pool and in-process queues."""
+
+    def __init__(self):
+        self.engine = None
+        self.sources: dict[str, object] = {}
+
+    def collect(self):
+        pool = getattr(self.engine, "pool", None)
+        if pool is not None and hasattr(pool, "checkedout"):
+            gauge = GaugeMetricFamily(
+                "supportlens_db_pool_connections", "DB connection pool state.", labels=["state"]
+            )
+            gauge.add_metric(["size"], pool.size())
+            gauge.add_metric(["checked_out"], pool.checkedout())
+            gauge.add_metric(["checked_in"], pool.checkedin())
+            gauge.add_metric(["overflow"], pool.overflow())
+            yield gauge
+
+        gauge = GaugeMetricFamily(
+            "supportlens_component_stat",
+            "Counters and sizes reported by in-process components.",
+            labels=["component", "stat"],
+        )
+        for component, source in self.sources.items():
+            for stat, value in source().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauge.add_metric([component, stat], value)
+        yield gauge
+
+
+_state = _StateCollector()
+REGISTRY.register(_state)
+
+
+def register(engine=None, **sources) -> None:
+    """Expose the engine's pool and each source's stats() dict as gauges."""
+    if engine is not None:
+        _state.engine = engine
+    _state.sources.update(sources)
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class Profiler(threading.Thread):
+    """Samples all thread stacks into a ring buffer of (time, stack)."""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, window_s: float = 120):
+        super().__init__(daemon=True, name="metrics-profiler")
+        self.interval_s = interval_ms / 1000
+        self.samples: deque[tuple[float, str]] = deque(maxlen=int(window_s / self.interval_s) * 8)
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        while not self._done.wait(self.interval_s):
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    self.samples.append((now, _collapse(frame)))
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+    def dump(self, name: str, started: float, ended: float) -> str | None:
+        stacks = Tally(stack for at, stack in list(self.samples) if started <= at <= ended)
+        if not stacks:
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.folded")
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+profiler: Profiler | None = None
+
+
+def start_profiler() -> None:
+    global profiler
+    if PROFILE_SLOW_MS > 0 and profiler is None:
+        profiler = Profiler()
+        profiler.start()
+
+
+def stop_profiler() -> None:
+    global profiler
+    if profiler is not None:
+        profiler.stop()
+        profiler = None
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            if route is not None and route not in _UNTIMED_ROUTES:
+                ended = time.perf_counter()
+                REQUEST_LATENCY.labels(scope["method"], route, str(status)).observe(ended - started)
+                if profiler is not None and (ended - started) * 1000 >= PROFILE_SLOW_MS:
+                    name = re.sub(r"[^\w]+", "_", f"{scope['method']}{route}").strip("_")
+                    path = await asyncio.to_thread(profiler.dump, name, started, ended)
+                    if path:
+                        logger.warning(
+                            "%s %s took %.0f ms; stacks in %s",
+                            scope["method"], route, (ended - started) * 1000, path,
+                        )
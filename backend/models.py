@@ -2,7 +2,8 @@ import enum
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Enum as SQLEnum, Integer, String
+from sqlalchemy import BigInteger, Column, DateTime, Enum as SQLEnum, Index, Integer, LargeBinary, String
+from sqlalchemy.orm import deferred
 
 from database import Base
 
@@ -13,14 +14,104 @@ class Category(str, enum.Enum):
     ACCOUNT_ACCESS = "Account Access"
     CANCELLATION = "Cancellation"
     GENERAL_INQUIRY = "General Inquiry"
+    # Persisted but not yet classified (see pipeline.py).
+    PENDING = "Pending"
+
+
+class LabelSource(str, enum.Enum):
+    """Which classifier.py stage decided a trace's category."""
+
+    LLM = "llm"
+    CACHE = "cache"
+    NEAR_DUPLICATE = "near_duplicate"
+    PREFILTER = "prefilter"
+
+
+def category_type() -> SQLEnum:
+    # VARCHAR on every backend rather than a native ENUM type, so adding a
+    # category never needs an ALTER TYPE migration.
+    return SQLEnum(Category, native_enum=False, length=32)
 
 
 class Trace(Base):
     __tablename__ = "traces"
+    __table_args__ = (
+        # Keyset pagination: newest-first pages are index range scans.
+        Index("ix_traces_timestamp_id", "timestamp", "id"),
+        Index("ix_traces_category_timestamp_id", "category", "timestamp", "id"),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     user_message = Column(String, nullable=False)
     bot_response = Column(String, nullable=False)
-    category = Column(SQLEnum(Category), nullable=False)
+    category = Column(category_type(), nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     response_time_ms = Column(Integer, nullable=False)
+    # Only known for streamed chat responses.
+    time_to_first_token_ms = Column(Integer, nullable=True)
+    # NULL while pending, and for seeded rows and rows that predate the column.
+    classified_by = Column(SQLEnum(LabelSource, native_enum=False, length=16), nullable=True)
+    # int8 vector of user_message (see vectors.py); only loaded when asked for.
+    embedding = deferred(Column(LargeBinary, nullable=True))
+
+
+class TraceRollup(Base):
+    """Per-category trace counts and latency sums per hour and per day (see rollups.py)."""
+
+    __tablename__ = "trace_rollups"
+
+    granularity = Column(String, primary_key=True)  # "hour" or "day"
+    bucket_start = Column(DateTime, primary_key=True)
+    category = Column(category_type(), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    latency_sum_ms = Column(BigInteger, nullable=False, default=0)
+
+
+class LatencyBin(Base):
+    """Latency sketch bins per rollup bucket (see sketch.py)."""
+
+    __tablename__ = "latency_bins"
+
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    category = Column(category_type(), primary_key=True)
+    bin = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class ClassificationCacheEntry(Base):
+    """Persistent tier of cache.ClassificationCache."""
+
+    __tablename__ = "classification_cache"
+
+    key = Column(String, primary_key=True)
+    # Hash of MODEL + CLASSIFICATION_PROMPT; rows from other versions are purged.
+    fingerprint = Column(String, nullable=False, index=True)
+    category = Column(category_type(), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class TableVersion(Base):
+    """Monotonic change counter per table, bumped in every write transaction
+    (see httpcache.py)."""
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ArchivePartition(Base):
+    """One month of archived traces in a compressed NDJSON file (see retention.py)."""
+
+    __tablename__ = "archive_partitions"
+
+    month = Column(String, primary_key=True)  # "YYYY-MM"
+    path = Column(String, nullable=False)
+    row_count = Column(BigInteger, nullable=False, default=0)
+    # Committed length of the file; bytes past it are from an interrupted batch.
+    size_bytes = Column(BigInteger, nullable=False, default=0)
+    first_timestamp = Column(DateTime, nullable=True)
+    last_timestamp = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
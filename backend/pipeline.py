@@ -0,0 +1,150 @@
+"""
+Background classification for traces ingested with a pending category.
+
+POST /traces?async_classify=true stores the trace as Category.PENDING and
+hands its id to the ClassificationQueue, whose workers call the LLM with
+bounded concurrency. llm.py already retries transient errors; a worker only
+tries again, after a longer jittered backoff, when those retries ran out.
+Other errors (bad request, auth) fail the trace at once.
+"""
+
+import asyncio
+import logging
+import os
+import random
+
+import classifier
+import events
+import httpcache
+import llm
+import rollups
+import vectors
+from database import SessionLocal
+from models import Category, LabelSource, Trace
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get("CLASSIFY_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.environ.get("CLASSIFY_MAX_ATTEMPTS", "3"))
+BACKOFF_BASE_S = float(os.environ.get("CLASSIFY_BACKOFF_BASE_S", "5"))
+BACKOFF_MAX_S = float(os.environ.get("CLASSIFY_BACKOFF_MAX_S", "60"))
+
+
+def _load_messages(trace_id: str) -> tuple[str, str] | None:
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(Trace.user_message, Trace.bot_response)
+            .filter(Trace.id == trace_id, Trace.category == Category.PENDING)
+            .first()
+        )
+        return (row.user_message, row.bot_response) if row else None
+    finally:
+        db.close()
+
+
+def _save_category(trace_id: str, category: Category, classified_by: LabelSource) -> None:
+    db = SessionLocal()
+    try:
+        trace = db.get(Trace, trace_id)
+        if trace is None or trace.category != Category.PENDING:
+            return
+        trace.category = category
+        trace.classified_by = classified_by
+        rollups.reclassify(db, trace, Category.PENDING)
+        response_time_ms = trace.response_time_ms
+        version = httpcache.bump(db)
+        db.commit()
+    finally:
+        db.close()
+    httpcache.response_cache.invalidate()
+    vectors.index.set_category(trace_id, category)
+    events.publish_reclassified(
+        trace_id, Category.PENDING, category, response_time_ms, version
+    )
+
+
+def _pending_ids() -> list[str]:
+    db = SessionLocal()
+    try:
+        rows = db.query(Trace.id).filter(Trace.category == Category.PENDING).all()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+class ClassificationQueue:
+    """In-process work queue drained by a fixed pool of asyncio workers."""
+
+    def __init__(self, workers: int = WORKERS):
+        self.workers = workers
+        self.in_flight = 0
+        self.classified = 0
+        self.retries = 0
+        self.failed = 0
+        self._queue: asyncio.Queue[str] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def backlog(self) -> int:
+        """Traces waiting for or undergoing classification."""
+        queued = self._queue.qsize() if self._queue else 0
+        return queued + self.in_flight
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+        # Re-enqueue anything left pending by a previous process.
+        for trace_id in await asyncio.to_thread(_pending_ids):
+            self._queue.put_nowait(trace_id)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, trace_id: str) -> None:
+        """Enqueue a trace id. Safe to call from threadpool endpoints."""
+        if self._loop is None:
+            raise RuntimeError("ClassificationQueue has not been started")
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, trace_id)
+
+    async def _worker(self) -> None:
+        while True:
+            trace_id = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await self._classify(trace_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logger.exception("Giving up classifying trace %s", trace_id)
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    async def _classify(self, trace_id: str) -> None:
+        messages = await asyncio.to_thread(_load_messages, trace_id)
+        if messages is None:
+            return
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                category, classified_by = await classifier.classify(*messages)
+                break
+            except Exception as e:
+                if attempt == MAX_ATTEMPTS or not llm.is_transient(e):
+                    raise
+                self.retries += 1
+                delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** (attempt - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        await asyncio.to_thread(_save_category, trace_id, category, classified_by)
+        self.classified += 1
+
+
+queue = ClassificationQueue()
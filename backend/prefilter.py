@@ -0,0 +1,280 @@
+"""
+Local naive-Bayes pre-classifier that runs before the LLM.
+
+Trained on the seed.py corpus plus rows the LLM labelled
+(Trace.classified_by), so its own predictions and labels copied from cache
+hits or near-duplicates never feed back into it; only predictions below
+PREFILTER_THRESHOLD confidence are escalated to llm.classify. A model with
+fewer than PREFILTER_MIN_SAMPLES examples of any category is not used.
+
+Run:
+    python prefilter.py train     # retrain from the database and save the model
+    python prefilter.py report    # agreement with LLM labels on a holdout split
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+
+sys.path.insert(0, ".")
+
+from database import SessionLocal
+from models import Category, LabelSource, Trace
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("PREFILTER_ENABLED", "1") == "1"
+THRESHOLD = float(os.environ.get("PREFILTER_THRESHOLD", "0.98"))
+MODEL_PATH = os.environ.get("PREFILTER_MODEL_PATH", "./prefilter_model.json")
+# Training examples every category needs before the model is saved or used.
+MIN_SAMPLES = int(os.environ.get("PREFILTER_MIN_SAMPLES", "5"))
+# Fraction of labelled rows `report` holds out of training.
+HOLDOUT = 0.2
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+
+def features(user_message: str, bot_response: str) -> list[str]:
+    """Unigrams and bigrams of the customer message, unigrams of the reply."""
+    words = _TOKEN.findall(user_message.lower())
+    feats = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    feats += ["r:" + w for w in _TOKEN.findall(bot_response.lower())]
+    return feats
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes with add-one smoothing."""
+
+    def __init__(self):
+        self.class_counts: Counter[str] = Counter()
+        self.token_counts: dict[str, Counter[str]] = defaultdict(Counter)
+        self.total_tokens: Counter[str] = Counter()
+        self.vocabulary: set[str] = set()
+
+    def fit(self, samples) -> "NaiveBayesClassifier":
+        """Train on an iterable of (user_message, bot_response, category)."""
+        for user_message, bot_response, category in samples:
+            feats = features(user_message, bot_response)
+            self.class_counts[category] += 1
+            self.token_counts[category].update(feats)
+            self.total_tokens[category] += len(feats)
+            self.vocabulary.update(feats)
+        return self
+
+    @property
+    def trained(self) -> bool:
+        return bool(self.class_counts)
+
+    def covers(self, min_samples: int = MIN_SAMPLES) -> bool:
+        """Whether every category has at least min_samples training examples."""
+        return all(
+            self.class_counts[c.value] >= min_samples for c in Category if c is not Category.PENDING
+        )
+
+    def predict(self, user_message: str, bot_response: str) -> tuple[str, float]:
+        """Return (category, posterior probability of that category)."""
+        feats = features(user_message, bot_response)
+        n_docs = sum(self.class_counts.values())
+        vocab = len(self.vocabulary) + 1
+        scores = {}
+        for category, n in self.class_counts.items():
+            counts = self.token_counts[category]
+            denominator = math.log(self.total_tokens[category] + vocab)
+            score = math.log(n / n_docs)
+            for feat in feats:
+                score += math.log(counts.get(feat, 0) + 1) - denominator
+            scores[category] = score
+
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        norm = sum(math.exp(s - top) for s in scores.values())
+        return best, 1.0 / norm
+
+    def to_dict(self) -> dict:
+        return {
+            "class_counts": dict(self.class_counts),
+            "token_counts": {c: dict(t) for c, t in self.token_counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NaiveBayesClassifier":
+        model = cls()
+        model.class_counts = Counter(data["class_counts"])
+        for category, tokens in data["token_counts"].items():
+            model.token_counts[category] = Counter(tokens)
+            model.total_tokens[category] = sum(tokens.values())
+            model.vocabulary.update(tokens)
+        return model
+
+
+class PreFilter:
+    """Thread-safe holder for the active model plus routing counters."""
+
+    def __init__(self, threshold: float = THRESHOLD, enabled: bool = ENABLED):
+        self.threshold = threshold
+        self.enabled = enabled
+        self.model = NaiveBayesClassifier()
+        self.handled = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+
+    def start(self, path: str = MODEL_PATH) -> None:
+        """Load (or train) the model in the background; until it is ready,
+        predict() escalates everything to the LLM."""
+        if self.enabled:
+            self._task = asyncio.create_task(self._load_in_background(path))
+
+    async def _load_in_background(self, path: str) -> None:
+        try:
+            await asyncio.to_thread(self.load, path)
+        except Exception:
+            logger.exception("Loading the pre-classifier failed")
+
+    def load(self, path: str = MODEL_PATH) -> None:
+        """Load the saved model, training one from the database if none exists.
+
+        A model that doesn't cover every category is left unused.
+        """
+        if not self.enabled:
+            return
+        if os.path.exists(path):
+            with open(path) as f:
+                model = NaiveBayesClassifier.from_dict(json.load(f))
+        else:
+            model = train(path)
+        if model.covers():
+            self.model = model
+        else:
+            logger.warning(
+                "Pre-classifier needs %d examples of every category; sending everything to the LLM",
+                MIN_SAMPLES,
+            )
+
+    def predict(self, user_message: str, bot_response: str) -> Category | None:
+        """Return a confident local label, or None to escalate to the LLM."""
+        # With one class seen, every input gets it at confidence 1.0.
+        if not (self.enabled and len(self.model.class_counts) >= 2):
+            return None
+        category, confidence = self.model.predict(user_message, bot_response)
+        confident = confidence >= self.threshold
+        with self._lock:
+            if confident:
+                self.handled += 1
+            else:
+                self.escalated += 1
+        return Category(category) if confident else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "trained": self.model.trained,
+                "threshold": self.threshold,
+                "handled": self.handled,
+                "escalated": self.escalated,
+            }
+
+
+def _in_holdout(trace_id: str) -> bool:
+    return hashlib.sha256(trace_id.encode()).digest()[0] < 256 * HOLDOUT
+
+
+def _labelled_rows(db):
+    return (
+        db.query(Trace.id, Trace.user_message, Trace.bot_response, Trace.category)
+        .filter(Trace.classified_by == LabelSource.LLM)
+        .yield_per(1000)
+    )
+
+
+def _seed_samples():
+    # Imported here: seed imports ingest, which imports the classifier.
+    from seed import SEED_TRACES
+
+    for data in SEED_TRACES:
+        yield data["user_message"], data["bot_response"], data["category"].value
+
+
+def train(path: str = MODEL_PATH, holdout: bool = False) -> NaiveBayesClassifier:
+    """Fit a model on the seed corpus and LLM-labelled traces and save it to `path`.
+
+    Seeded rows in the database carry no classified_by, so the corpus is
+    read from seed.py. A model that doesn't cover every category is not
+    saved, so the next start trains again.
+    """
+    db = SessionLocal()
+    try:
+        model = NaiveBayesClassifier().fit(_seed_samples())
+        model.fit(
+            (row.user_message, row.bot_response, row.category.value)
+            for row in _labelled_rows(db)
+            if not (holdout and _in_holdout(row.id))
+        )
+    finally:
+        db.close()
+    if path and model.covers():
+        with open(path, "w") as f:
+            json.dump(model.to_dict(), f)
+    return model
+
+
+def report(threshold: float = THRESHOLD) -> dict:
+    """Compare predictions against LLM labels on a holdout split."""
+    model = train(path="", holdout=True)
+    total = agree = confident = confident_agree = 0
+    per_category: dict[str, Counter] = defaultdict(Counter)
+    db = SessionLocal()
+    try:
+        for row in _labelled_rows(db):
+            if not _in_holdout(row.id):
+                continue
+            label = row.category.value
+            predicted, confidence = model.predict(row.user_message, row.bot_response)
+            total += 1
+            agree += predicted == label
+            per_category[label]["total"] += 1
+            per_category[label]["agree"] += predicted == label
+            if confidence >= threshold:
+                confident += 1
+                confident_agree += predicted == label
+    finally:
+        db.close()
+
+    def ratio(a, b):
+        return round(a / b, 4) if b else None
+
+    return {
+        "holdout_traces": total,
+        "agreement": ratio(agree, total),
+        "threshold": threshold,
+        "coverage": ratio(confident, total),
+        "agreement_above_threshold": ratio(confident_agree, confident),
+        "by_category": {
+            category: ratio(c["agree"], c["total"])
+            for category, c in sorted(per_category.items())
+        },
+    }
+
+
+prefilter = PreFilter()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "train"
+    if command == "train":
+        model = train()
+        if not model.covers():
+            sys.exit(f"Not saved: every category needs at least {MIN_SAMPLES} examples ({dict(model.class_counts)}).")
+        print(f"Trained on {sum(model.class_counts.values())} traces; saved to {MODEL_PATH}.")
+    elif command == "report":
+        print(json.dumps(report(), indent=2))
+    else:
+        sys.exit(f"Unknown command: {command} (expected 'train' or 'report')")
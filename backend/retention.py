@@ -0,0 +1,383 @@
+"""
+Trace retention: move old traces into monthly compressed NDJSON archives.
+
+With RETENTION_DAYS set, a background task wakes every RETENTION_INTERVAL_S
+and archives classified traces older than that many days (counted in whole
+UTC days), RETENTION_BATCH_SIZE at a time. Each batch is appended to
+ARCHIVE_DIR/<YYYY-MM>.ndjson.zst (.gz if `zstandard` isn't installed) as its
+own compressed frame, then deleted in a short transaction that also records
+the file's committed length. Bytes past that length are left over from an
+interrupted batch and are truncated before the next one. Rows are read and
+compressed first; the batch then holds a database lock from before the file
+is touched until its delete commits (BEGIN IMMEDIATE on SQLite, an advisory
+lock on PostgreSQL), so archivers in other processes or workers wait their
+turn, and starts over if one of them archived its rows in the meantime.
+
+Rollups are not touched, so /analytics still covers archived history, and
+rollups.rebuild() reads the archives back in. On SQLite an incremental
+vacuum returns the freed pages afterwards.
+
+Run:
+    python retention.py run       # one archival pass now
+    python retention.py vacuum    # enable incremental auto-vacuum on an existing
+                                  # SQLite file (full VACUUM; locks the database)
+"""
+
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import text
+
+sys.path.insert(0, ".")
+
+import httpcache
+import vectors
+from database import IS_SQLITE, SessionLocal, engine
+from models import ArchivePartition, Category, Trace
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = float(os.environ.get("RETENTION_DAYS", "0"))
+RETENTION_INTERVAL_S = float(os.environ.get("RETENTION_INTERVAL_S", "3600"))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "1000"))
+# Pause between batches so request writes are never starved.
+RETENTION_PAUSE_MS = float(os.environ.get("RETENTION_PAUSE_MS", "50"))
+RETENTION_VACUUM_PAGES = int(os.environ.get("RETENTION_VACUUM_PAGES", "2000"))
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "./archive")
+
+# Key of the PostgreSQL advisory lock taken by each batch.
+_LOCK_KEY = 7_301_018
+
+_COLUMNS = [
+    Trace.id,
+    Trace.user_message,
+    Trace.bot_response,
+    Trace.category,
+    Trace.timestamp,
+    Trace.response_time_ms,
+    Trace.time_to_first_token_ms,
+]
+
+
+def _extension() -> str:
+    return ".ndjson.zst" if zstandard is not None else ".ndjson.gz"
+
+
+def _compress(data: bytes, path: str) -> bytes:
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path} needs the zstandard package")
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9)
+
+
+class _Committed(io.RawIOBase):
+    """Reads a file only up to its committed length."""
+
+    def __init__(self, raw, limit: int):
+        self._raw = raw
+        self._remaining = limit
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._remaining <= 0:
+            return 0
+        view = memoryview(buffer)[: self._remaining]
+        count = self._raw.readinto(view)
+        self._remaining -= count
+        return count
+
+
+def _lines(partition: ArchivePartition) -> Iterator[str]:
+    if not partition.size_bytes or not os.path.exists(partition.path):
+        return
+    with open(partition.path, "rb") as raw:
+        committed = io.BufferedReader(_Committed(raw, partition.size_bytes))
+        if partition.path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"{partition.path} needs the zstandard package")
+            stream = zstandard.ZstdDecompressor().stream_reader(committed, read_across_frames=True)
+        else:
+            stream = gzip.GzipFile(fileobj=committed)
+        yield from io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def read(
+    db,
+    category: Optional[Category] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Iterator[dict]:
+    """Yield archived traces matching the filters, month by month."""
+    partitions = db.query(ArchivePartition).order_by(ArchivePartition.month).all()
+    for partition in partitions:
+        if start is not None and partition.last_timestamp is not None and partition.last_timestamp < start:
+            continue
+        if end is not None and partition.first_timestamp is not None and partition.first_timestamp >= end:
+            continue
+        for line in _lines(partition):
+            record = json.loads(line)
+            if category is not None and record["category"] != category.value:
+                continue
+            timestamp = datetime.fromisoformat(record["timestamp"])
+            if (start is not None and timestamp < start) or (end is not None and timestamp >= end):
+                continue
+            yield record
+
+
+def stream_ndjson(
+    category: Optional[Category] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[bytes]:
+    """Encode matching archived traces as NDJSON, a few hundred lines per chunk."""
+    db = SessionLocal()
+    try:
+        lines = []
+        for count, record in enumerate(read(db, category, start, end)):
+            if limit is not None and count >= limit:
+                break
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+            if len(lines) >= 500:
+                yield "".join(lines).encode()
+                lines = []
+        if lines:
+            yield "".join(lines).encode()
+    finally:
+        db.close()
+
+
+def cutoff(now: Optional[datetime] = None) -> datetime:
+    """Traces before this (a UTC midnight) are due for archival."""
+    due = (now or datetime.utcnow()) - timedelta(days=RETENTION_DAYS)
+    return due.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _lock(db) -> None:
+    """Block other archivers until this transaction ends."""
+    if IS_SQLITE:
+        # pysqlite defers BEGIN until the first write; take the write lock now.
+        db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+    else:
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY})
+
+
+def _repair(db) -> None:
+    """Drop bytes written by batches whose delete never committed."""
+    for partition in db.query(ArchivePartition):
+        if os.path.exists(partition.path) and os.path.getsize(partition.path) > partition.size_bytes:
+            with open(partition.path, "r+b") as f:
+                f.truncate(partition.size_bytes)
+
+
+def _frame(rows, path: str) -> bytes:
+    payload = "".join(
+        json.dumps(
+            {
+                "id": row.id,
+                "user_message": row.user_message,
+                "bot_response": row.bot_response,
+                "category": row.category.value,
+                "timestamp": row.timestamp.isoformat(),
+                "response_time_ms": row.response_time_ms,
+                "time_to_first_token_ms": row.time_to_first_token_ms,
+            },
+            ensure_ascii=False,
+        )
+        + "\n"
+        for row in rows
+    )
+    return _compress(payload.encode(), path)
+
+
+def _archive_batch(db, before: datetime) -> int:
+    while True:
+        # Read and compress without the lock; it is only held for the
+        # appends and the delete.
+        rows = (
+            db.query(*_COLUMNS)
+            .filter(Trace.timestamp < before, Trace.category != Category.PENDING)
+            .order_by(Trace.timestamp, Trace.id)
+            .limit(RETENTION_BATCH_SIZE)
+            .all()
+        )
+        if not rows:
+            db.rollback()
+            return 0
+
+        by_month = defaultdict(list)
+        for row in rows:
+            by_month[row.timestamp.strftime("%Y-%m")].append(row)
+        frames = {}
+        for month, month_rows in by_month.items():
+            partition = db.get(ArchivePartition, month)
+            path = partition.path if partition else os.path.join(ARCHIVE_DIR, month + _extension())
+            frames[month] = path, _frame(month_rows, path)
+        db.rollback()
+
+        _lock(db)
+        ids = [row.id for row in rows]
+        # Another archiver may have taken some of these rows, or created a
+        # partition under another extension, in the meantime.
+        taken = db.query(Trace.id).filter(Trace.id.in_(ids)).count() < len(ids)
+        moved = any(
+            partition.path != frames[partition.month][0]
+            for partition in db.query(ArchivePartition).filter(ArchivePartition.month.in_(frames))
+        )
+        if not (taken or moved):
+            break
+        db.rollback()
+
+    _repair(db)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    for month, month_rows in by_month.items():
+        path, frame = frames[month]
+        partition = db.get(ArchivePartition, month)
+        if partition is None:
+            partition = ArchivePartition(month=month, path=path, row_count=0, size_bytes=0)
+            db.add(partition)
+        with open(partition.path, "ab") as f:
+            f.truncate(partition.size_bytes)
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        partition.size_bytes += len(frame)
+        partition.row_count += len(month_rows)
+        first, last = month_rows[0].timestamp, month_rows[-1].timestamp
+        partition.first_timestamp = min(filter(None, [partition.first_timestamp, first]))
+        partition.last_timestamp = max(filter(None, [partition.last_timestamp, last]))
+
+    db.query(Trace).filter(Trace.id.in_(ids)).delete(synchronize_session=False)
+    httpcache.bump(db)
+    db.commit()
+    httpcache.response_cache.invalidate()
+    vectors.index.remove(ids)
+    return len(rows)
+
+
+def incremental_vacuum(stop: Optional[threading.Event] = None) -> int:
+    """Return free SQLite pages to the filesystem in small steps; returns pages freed."""
+    if not IS_SQLITE:
+        return 0
+    freed = 0
+    raw = engine.raw_connection()
+    try:
+        # executescript() steps the pragma to completion; execute() frees one page.
+        conn = raw.driver_connection
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.info("auto_vacuum is not INCREMENTAL; run `python retention.py vacuum` to enable it")
+            return 0
+        while not (stop and stop.is_set()):
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            conn.executescript(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES});")
+            freed += min(free, RETENTION_VACUUM_PAGES)
+            time.sleep(RETENTION_PAUSE_MS / 1000)
+    finally:
+        raw.close()
+    return freed
+
+
+def run_once(before: Optional[datetime] = None, stop: Optional[threading.Event] = None) -> int:
+    """Archive every due trace in batches; returns the number archived."""
+    before = before or cutoff()
+    archived = 0
+    db = SessionLocal()
+    try:
+        while not (stop and stop.is_set()):
+            count = _archive_batch(db, before)
+            if not count:
+                break
+            archived += count
+            time.sleep(RETENTION_PAUSE_MS / 1000)
+    finally:
+        db.close()
+    if archived:
+        incremental_vacuum(stop)
+    return archived
+
+
+class Archiver:
+    """Runs run_once() every RETENTION_INTERVAL_S while RETENTION_DAYS is set."""
+
+    def __init__(self):
+        self.passes = 0
+        self.archived = 0
+        self.failed_passes = 0
+        self._stop = threading.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return RETENTION_DAYS > 0
+
+    def start(self) -> None:
+        if self.enabled:
+            self._stop.clear()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                self.archived += await asyncio.to_thread(run_once, None, self._stop)
+                self.passes += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed_passes += 1
+                logger.exception("Retention pass failed")
+            await asyncio.sleep(RETENTION_INTERVAL_S)
+
+    def stats(self) -> dict:
+        return {
+            "passes": self.passes,
+            "archived": self.archived,
+            "failed_passes": self.failed_passes,
+        }
+
+
+archiver = Archiver()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    if command == "run":
+        if RETENTION_DAYS <= 0:
+            sys.exit("Set RETENTION_DAYS to the number of days of traces to keep.")
+        print(f"Archived {run_once()} traces older than {cutoff().isoformat()}.")
+    elif command == "vacuum":
+        if not IS_SQLITE:
+            sys.exit("vacuum only applies to SQLite.")
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
+        print("Enabled incremental auto-vacuum.")
+    else:
+        sys.exit(f"Unknown command: {command} (expected 'run' or 'vacuum')")
@@ -0,0 +1,256 @@
+"""
+Incrementally maintained analytics rollups.
+
+Every trace write updates per-category hourly and daily buckets, and the
+latency sketch bins for those buckets, in the same transaction, so
+/analytics reads O(buckets) rows instead of scanning traces.
+
+Run:
+    python rollups.py rebuild     # recompute every bucket from traces and archives
+"""
+
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, ".")
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import retention
+from database import SessionLocal
+from models import Category, LatencyBin, Trace, TraceRollup
+from sketch import LatencySketch, bin_index
+
+
+def _hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _day(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+GRANULARITIES = {"hour": _hour, "day": _day}
+
+class _Deltas:
+    """Pending increments to rollup buckets and latency bins."""
+
+    def __init__(self):
+        # (granularity, bucket_start, category) -> [count, latency_sum_ms]
+        self.buckets: dict[tuple[str, datetime, Category], list[int]] = {}
+        # (granularity, bucket_start, category, bin) -> count
+        self.bins: dict[tuple[str, datetime, Category, int], int] = {}
+
+    def add(self, timestamp: datetime, category: Category, count: int, latency_ms: int):
+        """Add `count` traces (negative to remove) with latency `latency_ms` each."""
+        latency_bin = bin_index(latency_ms)
+        for granularity, truncate in GRANULARITIES.items():
+            key = (granularity, truncate(timestamp), category)
+            bucket = self.buckets.setdefault(key, [0, 0])
+            bucket[0] += count
+            bucket[1] += count * latency_ms
+            self.bins[(*key, latency_bin)] = self.bins.get((*key, latency_bin), 0) + count
+
+
+def _upsert(db: Session, model, rows: list[dict], increments: list[str]) -> None:
+    """Insert rows, adding the `increments` columns onto any existing row."""
+    if not rows:
+        return
+    keys = [column.name for column in model.__table__.primary_key]
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt = insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={
+                name: getattr(model, name) + getattr(stmt.excluded, name)
+                for name in increments
+            },
+        )
+        db.execute(stmt, rows)
+        return
+
+    for row in rows:
+        existing = db.get(model, tuple(row[key] for key in keys))
+        if existing is None:
+            db.add(model(**row))
+        else:
+            for name in increments:
+                setattr(existing, name, getattr(existing, name) + row[name])
+
+
+def _apply(db: Session, deltas: _Deltas) -> None:
+    _upsert(
+        db,
+        TraceRollup,
+        [
+            {
+                "granularity": granularity,
+                "bucket_start": bucket_start,
+                "category": category,
+                "count": count,
+                "latency_sum_ms": latency_sum,
+            }
+            for (granularity, bucket_start, category), (count, latency_sum) in deltas.buckets.items()
+            if count or latency_sum
+        ],
+        ["count", "latency_sum_ms"],
+    )
+    _upsert(
+        db,
+        LatencyBin,
+        [
+            {
+                "granularity": granularity,
+                "bucket_start": bucket_start,
+                "category": category,
+                "bin": latency_bin,
+                "count": count,
+            }
+            for (granularity, bucket_start, category, latency_bin), count in deltas.bins.items()
+            if count
+        ],
+        ["count"],
+    )
+
+
+def record(db: Session, traces: list[Trace]) -> None:
+    """Add new traces to their buckets. Call before committing the insert."""
+    deltas = _Deltas()
+    for trace in traces:
+        deltas.add(trace.timestamp, trace.category, 1, trace.response_time_ms)
+    _apply(db, deltas)
+
+
+def reclassify(db: Session, trace: Trace, old_category: Category) -> None:
+    """Move a trace from old_category's buckets to its current category's."""
+    deltas = _Deltas()
+    deltas.add(trace.timestamp, old_category, -1, trace.response_time_ms)
+    deltas.add(trace.timestamp, trace.category, 1, trace.response_time_ms)
+    _apply(db, deltas)
+
+
+def _ranges(start: datetime | None, end: datetime | None):
+    """Split [start, end) into (granularity, start, end) ranges of whole buckets.
+
+    Bounds are widened to whole hours. Whole days inside the range are read
+    from daily buckets and only the partial days at either edge from hourly ones.
+    """
+    start = _hour(start) if start else None
+    if end is not None and end != _hour(end):
+        end = _hour(end) + timedelta(hours=1)
+
+    first_day = _day(start) if start else None
+    if first_day is not None and first_day != start:
+        first_day += timedelta(days=1)
+    last_day = _day(end) if end else None
+
+    if first_day is not None and last_day is not None and first_day >= last_day:
+        return [("hour", start, end)]
+    ranges = [("day", first_day, last_day)]
+    if start is not None and start < first_day:
+        ranges.append(("hour", start, first_day))
+    if end is not None and last_day < end:
+        ranges.append(("hour", last_day, end))
+    return ranges
+
+
+def _in_range(query, model, granularity: str, start: datetime | None, end: datetime | None):
+    query = query.filter(model.granularity == granularity)
+    if start is not None:
+        query = query.filter(model.bucket_start >= start)
+    if end is not None:
+        query = query.filter(model.bucket_start < end)
+    return query
+
+
+def summarize(
+    db: Session, start: datetime | None = None, end: datetime | None = None
+) -> dict[Category, tuple[int, int]]:
+    """Return {category: (count, latency_sum_ms)} for traces in [start, end)."""
+    totals: dict[Category, list[int]] = defaultdict(lambda: [0, 0])
+    for granularity, range_start, range_end in _ranges(start, end):
+        query = db.query(
+            TraceRollup.category,
+            func.sum(TraceRollup.count),
+            func.sum(TraceRollup.latency_sum_ms),
+        )
+        query = _in_range(query, TraceRollup, granularity, range_start, range_end)
+        for category, count, latency_sum in query.group_by(TraceRollup.category):
+            totals[category][0] += count or 0
+            totals[category][1] += latency_sum or 0
+    return {
+        category: (count, latency_sum)
+        for category, (count, latency_sum) in totals.items()
+        if count > 0
+    }
+
+
+def latency_sketches(
+    db: Session, start: datetime | None = None, end: datetime | None = None
+) -> dict[Category, LatencySketch]:
+    """Return a merged latency sketch per category for traces in [start, end)."""
+    sketches: dict[Category, LatencySketch] = defaultdict(LatencySketch)
+    for granularity, range_start, range_end in _ranges(start, end):
+        query = db.query(LatencyBin.category, LatencyBin.bin, func.sum(LatencyBin.count))
+        query = _in_range(query, LatencyBin, granularity, range_start, range_end)
+        for category, latency_bin, count in query.group_by(LatencyBin.category, LatencyBin.bin):
+            if count:
+                sketches[category].add_bin(latency_bin, count)
+    return {category: sketch for category, sketch in sketches.items() if sketch.count}
+
+
+def rebuild(db: Session) -> int:
+    """Recompute every bucket from the traces table and the retention
+    archives; returns traces counted."""
+    deltas = _Deltas()
+    total = 0
+    rows = db.query(Trace.timestamp, Trace.category, Trace.response_time_ms).yield_per(10000)
+    for timestamp, category, response_time_ms in rows:
+        deltas.add(timestamp, category, 1, response_time_ms)
+        total += 1
+    for record in retention.read(db):
+        deltas.add(
+            datetime.fromisoformat(record["timestamp"]),
+            Category(record["category"]),
+            1,
+            record["response_time_ms"],
+        )
+        total += 1
+    db.query(TraceRollup).delete(synchronize_session=False)
+    db.query(LatencyBin).delete(synchronize_session=False)
+    _apply(db, deltas)
+    db.commit()
+    return total
+
+
+def ensure_built() -> None:
+    """Backfill rollups for databases that predate them."""
+    db = SessionLocal()
+    try:
+        has_rollups = (
+            db.query(TraceRollup.granularity).first() is not None
+            and db.query(LatencyBin.granularity).first() is not None
+        )
+        has_traces = db.query(Trace.id).first() is not None
+        if has_traces and not has_rollups:
+            rebuild(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    if command != "rebuild":
+        sys.exit(f"Unknown command: {command} (expected 'rebuild')")
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt rollups from {rebuild(db)} traces.")
+    finally:
+        db.close()
@@ -10,6 +10,7 @@ class TraceCreate(BaseModel):
     user_message: str
     bot_response: str
     response_time_ms: int
+    time_to_first_token_ms: Optional[int] = None
 
 
 class TraceResponse(BaseModel):
@@ -19,20 +20,73 @@ class TraceResponse(BaseModel):
     category: Category
     timestamp: datetime
     response_time_ms: int
+    time_to_first_token_ms: Optional[int] = None
+    # Only set on full-text search results.
+    score: Optional[float] = None
+    snippet: Optional[str] = None
 
     model_config = {"from_attributes": True}
 
 
+class TracePage(BaseModel):
+    items: list[TraceResponse]
+    next_cursor: Optional[str] = None
+
+
+class LatencyPercentiles(BaseModel):
+    p50: float
+    p95: float
+    p99: float
+
+
+class HistogramBucket(BaseModel):
+    le_ms: Optional[int]  # upper edge; None for the overflow bucket
+    count: int
+
+
 class CategoryStat(BaseModel):
     category: str
     count: int
     percentage: float
+    latency: Optional[LatencyPercentiles] = None
 
 
 class Analytics(BaseModel):
     total_traces: int
     by_category: list[CategoryStat]
     avg_response_time_ms: float
+    pending_traces: int = 0
+    latency: Optional[LatencyPercentiles] = None
+    latency_histogram: list[HistogramBucket] = []
+
+
+class CacheStats(BaseModel):
+    size: int
+    max_entries: int
+    hits: int
+    persistent_hits: int
+    misses: int
+    evictions: int
+
+
+class PreFilterStats(BaseModel):
+    enabled: bool
+    trained: bool
+    threshold: float
+    handled: int
+    escalated: int
+
+
+class ClassificationStatus(BaseModel):
+    pending_traces: int
+    backlog: int
+    in_flight: int
+    workers: int
+    classified: int
+    retries: int
+    failed: int
+    cache: CacheStats
+    prefilter: PreFilterStats
 
 
 class ChatRequest(BaseModel):
@@ -42,3 +96,36 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     response_time_ms: int
+
+
+class ArchivePartitionInfo(BaseModel):
+    month: str
+    row_count: int
+    size_bytes: int
+    first_timestamp: Optional[datetime] = None
+    last_timestamp: Optional[datetime] = None
+
+    model_config = {"from_attributes": True}
+
+
+class SimilarTrace(TraceResponse):
+    similarity: float
+
+
+class IssueCluster(BaseModel):
+    representative: str
+    examples: list[str]
+    # Traces in the window, and the count a typical window of the baseline had.
+    size: int
+    baseline: float
+    growth: float
+    cohesion: float
+    categories: dict[str, int]
+
+
+class ClusterReport(BaseModel):
+    generated_at: datetime
+    window_hours: float
+    baseline_days: float
+    traces: int
+    clusters: list[IssueCluster]
@@ -0,0 +1,186 @@
+"""
+Full-text search over trace messages.
+
+SQLite uses an external-content FTS5 table kept in sync with `traces` by
+triggers; PostgreSQL uses a GIN index on a tsvector expression. Both rank
+matches and return a highlighted snippet with <mark>…</mark> around hits.
+"""
+
+import logging
+import re
+
+from sqlalchemy import column, func, literal_column, select, table, text
+from sqlalchemy.engine import Engine
+
+from models import Trace
+
+logger = logging.getLogger(__name__)
+
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE traces_fts USING fts5(
+        user_message, bot_response,
+        content='traces', content_rowid='rowid', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS traces_fts_ai AFTER INSERT ON traces BEGIN
+        INSERT INTO traces_fts(rowid, user_message, bot_response)
+        VALUES (new.rowid, new.user_message, new.bot_response);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS traces_fts_ad AFTER DELETE ON traces BEGIN
+        INSERT INTO traces_fts(traces_fts, rowid, user_message, bot_response)
+        VALUES ('delete', old.rowid, old.user_message, old.bot_response);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS traces_fts_au AFTER UPDATE OF user_message, bot_response ON traces BEGIN
+        INSERT INTO traces_fts(traces_fts, rowid, user_message, bot_response)
+        VALUES ('delete', old.rowid, old.user_message, old.bot_response);
+        INSERT INTO traces_fts(rowid, user_message, bot_response)
+        VALUES (new.rowid, new.user_message, new.bot_response);
+    END""",
+    # Index whatever was written before the FTS table existed.
+    "INSERT INTO traces_fts(traces_fts) VALUES ('rebuild')",
+]
+
+# Must match the expression used in queries exactly for the index to apply.
+_PG_DOCUMENT = "traces.user_message || ' ' || traces.bot_response"
+_PG_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_traces_fts ON traces "
+    f"USING GIN (to_tsvector('english', {_PG_DOCUMENT.replace('traces.', '')}))",
+]
+
+_WORD = re.compile(r"\w+")
+
+# Above this many matches, sort=recent walks the timestamp index instead of
+# looking up and sorting every match.
+RECENT_LOOKUP_MAX_MATCHES = 5000
+
+
+def install(engine: Engine) -> None:
+    """Create the search index and, on SQLite, its sync triggers."""
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = 'traces_fts'"
+            ).first()
+            if not exists:
+                for statement in _SQLITE_DDL:
+                    conn.exec_driver_sql(statement)
+        elif engine.dialect.name == "postgresql":
+            for statement in _PG_DDL:
+                conn.exec_driver_sql(statement)
+        else:
+            logger.warning("Full-text search is not supported on %s", engine.dialect.name)
+
+
+def _fts5_query(q: str) -> str:
+    """Quote each whitespace-separated term as an FTS5 phrase; terms are ANDed.
+
+    This keeps user input from being parsed as FTS5 syntax, and keeps
+    identifiers like INV-2024-001 together as a phrase.
+    """
+    phrases = []
+    for term in q.split():
+        words = _WORD.findall(term)
+        if words:
+            phrases.append('"' + " ".join(words) + '"')
+    return " ".join(phrases)
+
+
+def apply(
+    query, q: str, dialect: str, *, by_relevance: bool, where=(), offset: int = 0, limit: int
+):
+    """Restrict a query over traces to one page of rows matching q.
+
+    The page is picked by an inner query that carries only row keys, so
+    bodies are read and snippets built for `limit` rows rather than for
+    every match. `where` holds extra conditions on traces (category, keyset
+    cursor). Results are ordered by score, or newest first when not
+    by_relevance.
+
+    Returns (query, score, snippet): score is higher for better matches.
+    Raises ValueError if q has no searchable terms.
+    """
+    if dialect == "sqlite":
+        fts_query = _fts5_query(q)
+        if not fts_query:
+            raise ValueError("Search query has no searchable terms")
+        fts = table("traces_fts", column("rowid"))
+        rowid = literal_column("traces.rowid")
+        match = text("traces_fts MATCH :fts_query").bindparams(fts_query=fts_query)
+        matching = select(fts.c.rowid).where(match)
+        # A unary + keeps SQLite from pushing `rowid IN` into the other side
+        # as one lookup per listed row.
+        if by_relevance:
+            # Scored from the FTS index alone; traces is only read for filters.
+            hits = select(fts.c.rowid.label("key")).where(match)
+            if where:
+                rows = select(rowid).select_from(Trace.__table__).where(*where)
+                hits = hits.where(literal_column("+traces_fts.rowid").in_(rows))
+            hits = hits.order_by(func.bm25(literal_column("traces_fts")), fts.c.rowid)
+        else:
+            # Few matches: look each one up and sort them. Many: walk
+            # ix_traces_timestamp_id newest first until the page is full.
+            probe = select(func.count()).select_from(
+                matching.limit(RECENT_LOOKUP_MAX_MATCHES + 1).subquery()
+            )
+            few = query.session.execute(probe).scalar() <= RECENT_LOOKUP_MAX_MATCHES
+            key = rowid if few else literal_column("+traces.rowid")
+            hits = (
+                select(rowid.label("key"))
+                .select_from(Trace.__table__)
+                .where(key.in_(matching), *where)
+                .order_by(Trace.timestamp.desc(), Trace.id.desc())
+            )
+        hits = hits.offset(offset).limit(limit).cte("hits")
+
+        # bm25() scans the whole doclist once per FTS cursor, so score and
+        # snippet the page's rows in a single MATCH; MATERIALIZED stops
+        # SQLite from turning it back into one cursor per row.
+        found = (
+            select(
+                fts.c.rowid.label("key"),
+                (-func.bm25(literal_column("traces_fts"))).label("score"),
+                func.snippet(
+                    literal_column("traces_fts"), -1, SNIPPET_START, SNIPPET_END, "…", 16
+                ).label("snippet"),
+            )
+            .where(match, literal_column("+traces_fts.rowid").in_(select(hits.c.key)))
+            .cte("found")
+            .prefix_with("MATERIALIZED")
+        )
+        query = (
+            query.select_from(Trace)
+            .join(hits, rowid == hits.c.key)
+            .join(found, found.c.key == hits.c.key)
+        )
+        score, snippet = found.c.score, found.c.snippet
+    elif dialect == "postgresql":
+        if not _WORD.search(q):
+            raise ValueError("Search query has no searchable terms")
+        english = literal_column("'english'")
+        document = literal_column(f"to_tsvector('english', {_PG_DOCUMENT})")
+        ts_query = func.websearch_to_tsquery(english, q)
+        score = func.ts_rank_cd(document, ts_query)
+        hits = select(Trace.id.label("key")).where(document.op("@@")(ts_query), *where)
+        if by_relevance:
+            hits = hits.order_by(score.desc(), Trace.id)
+        else:
+            hits = hits.order_by(Trace.timestamp.desc(), Trace.id.desc())
+        hits = hits.offset(offset).limit(limit).subquery("hits")
+
+        query = query.join(hits, Trace.id == hits.c.key)
+        snippet = func.ts_headline(
+            english,
+            Trace.user_message + literal_column("' '") + Trace.bot_response,
+            ts_query,
+            f"StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords=32, MinWords=12",
+        )
+    else:
+        raise ValueError(f"Full-text search is not supported on {dialect}")
+
+    if by_relevance:
+        query = query.order_by(score.desc(), hits.c.key)
+    else:
+        query = query.order_by(Trace.timestamp.desc(), Trace.id.desc())
+    return query, score, snippet
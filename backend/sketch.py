@@ -0,0 +1,71 @@
+"""
+Mergeable latency sketch with relative-error guarantees (DDSketch-style).
+
+A latency x > 0 falls in bin ceil(log_gamma(x)); any quantile read back from
+the bins is within RELATIVE_ACCURACY of the true value. Bins from different
+sketches merge by adding counts, which lets rollups.py store them per
+category and time bucket and sum them at query time.
+"""
+
+import math
+
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+# Latencies are clamped to this range before binning (1 ms .. 1 hour).
+MIN_MS = 1
+MAX_MS = 3_600_000
+
+# Upper edges (ms) of the coarse histogram returned by /analytics.
+HISTOGRAM_EDGES_MS = [250, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000]
+
+
+def bin_index(latency_ms: int) -> int:
+    latency_ms = min(max(latency_ms, MIN_MS), MAX_MS)
+    return math.ceil(math.log(latency_ms) / _LOG_GAMMA)
+
+
+def bin_value(index: int) -> float:
+    """Representative latency of a bin: the midpoint in relative terms."""
+    return 2 * GAMMA**index / (GAMMA + 1)
+
+
+class LatencySketch:
+    def __init__(self, bins: dict[int, int] | None = None):
+        self.bins: dict[int, int] = dict(bins or {})
+
+    @property
+    def count(self) -> int:
+        return sum(self.bins.values())
+
+    def add(self, latency_ms: int, count: int = 1) -> None:
+        self.add_bin(bin_index(latency_ms), count)
+
+    def add_bin(self, index: int, count: int) -> None:
+        self.bins[index] = self.bins.get(index, 0) + count
+
+    def merge(self, other: "LatencySketch") -> None:
+        for index, count in other.bins.items():
+            self.add_bin(index, count)
+
+    def quantile(self, q: float) -> float:
+        total = self.count
+        if total == 0:
+            return 0.0
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return bin_value(index)
+        return bin_value(max(self.bins))
+
+    def histogram(self, edges: list[int] = HISTOGRAM_EDGES_MS) -> list[tuple[int | None, int]]:
+        """Counts per (upper edge ms, count); the last bucket's edge is None (overflow)."""
+        counts = [0] * (len(edges) + 1)
+        for index, count in self.bins.items():
+            value = bin_value(index)
+            slot = next((i for i, edge in enumerate(edges) if value <= edge), len(edges))
+            counts[slot] += count
+        return list(zip([*edges, None], counts))
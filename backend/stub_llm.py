@@ -0,0 +1,132 @@
+"""
+Local stand-in for the Groq chat completions API, for development and tests
+without spending Groq quota.
+
+Run:
+    uvicorn stub_llm:app --port 9000
+    GROQ_BASE_URL=http://localhost:9000 uvicorn main:app --port 8000
+
+STUB_LATENCY_MS, STUB_JITTER_MS and STUB_ERROR_RATE simulate a slow or
+flaky upstream for load tests (see bench.py).
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Delay before a reply (or its first streamed chunk), uniformly +/- jitter.
+STUB_LATENCY_MS = float(os.environ.get("STUB_LATENCY_MS", "0"))
+STUB_JITTER_MS = float(os.environ.get("STUB_JITTER_MS", "0"))
+# Fraction of requests answered with STUB_ERROR_STATUS instead of a reply.
+STUB_ERROR_RATE = float(os.environ.get("STUB_ERROR_RATE", "0"))
+STUB_ERROR_STATUS = int(os.environ.get("STUB_ERROR_STATUS", "503"))
+# Delay between streamed chunks.
+STUB_TOKEN_INTERVAL_MS = float(os.environ.get("STUB_TOKEN_INTERVAL_MS", "0"))
+
+app = FastAPI(title="SupportLens LLM stub")
+
+CHAT_REPLY = (
+    "Thanks for reaching out! I can help with that. You can manage this from "
+    "Settings → Billing, and our support team at support@billpro.com can assist "
+    "with anything account-specific."
+)
+
+# First matching keyword wins; anything else is a General Inquiry.
+KEYWORD_CATEGORIES = [
+    (("refund", "money back", "double charged", "reimburse"), "Refund"),
+    (("cancel", "downgrade", "close our account", "pause"), "Cancellation"),
+    (("password", "log in", "login", "locked", "2fa", "authenticator", "logged out"), "Account Access"),
+    (("charge", "invoice", "billing", "payment", "card", "price"), "Billing"),
+]
+
+_CUSTOMER_MESSAGE = re.compile(r"Customer Message:\n(.*?)\n\nSupport Response:", re.S)
+
+
+def _category(customer_message: str) -> str:
+    text = customer_message.lower()
+    for keywords, category in KEYWORD_CATEGORIES:
+        if any(keyword in text for keyword in keywords):
+            return category
+    return "General Inquiry"
+
+
+def _reply(messages: list[dict]) -> str:
+    prompt = messages[-1]["content"]
+    customer_messages = _CUSTOMER_MESSAGE.findall(prompt)
+    if "Classify each of the following" in prompt:
+        return "\n".join(
+            f"{i}: {_category(message)}" for i, message in enumerate(customer_messages, start=1)
+        )
+    if "support ticket classifier" in prompt and customer_messages:
+        return _category(customer_messages[0])
+    return CHAT_REPLY
+
+
+def _usage(messages: list[dict], content: str) -> dict:
+    # Word counts stand in for tokens.
+    prompt_tokens = sum(len(m["content"].split()) for m in messages)
+    completion_tokens = len(content.split())
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _completion(model: str, content: str, usage: dict) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": usage,
+    }
+
+
+async def _chunks(model: str, content: str):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    for i, token in enumerate(re.findall(r"\S+\s*", content)):
+        if i and STUB_TOKEN_INTERVAL_MS:
+            await asyncio.sleep(STUB_TOKEN_INTERVAL_MS / 1000)
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub")
+    delay_ms = STUB_LATENCY_MS + random.uniform(-STUB_JITTER_MS, STUB_JITTER_MS)
+    if delay_ms > 0:
+        await asyncio.sleep(delay_ms / 1000)
+    if random.random() < STUB_ERROR_RATE:
+        return JSONResponse(
+            {"error": {"message": "Simulated upstream error", "type": "stub_error"}},
+            status_code=STUB_ERROR_STATUS,
+            headers={"retry-after-ms": "100"} if STUB_ERROR_STATUS == 429 else None,
+        )
+    content = _reply(body["messages"])
+    if body.get("stream"):
+        return StreamingResponse(_chunks(model, content), media_type="text/event-stream")
+    return _completion(model, content, _usage(body["messages"], content))
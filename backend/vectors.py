@@ -0,0 +1,405 @@
+"""
+Embeddings and an approximate nearest-neighbour index over user messages.
+
+encode() hashes character 3/4-grams plus word unigrams and bigrams of the
+normalized message into EMBEDDING_DIM signed buckets, L2-normalizes them
+and stores them as int8 (cosine similarity ~ dot / 127**2). Vectors live in
+traces.embedding and in an in-memory IVF index: vectors are grouped around
+k-means centroids and a query scores only the VECTOR_NPROBE closest groups.
+Below VECTOR_BRUTE_FORCE_MAX vectors the index scans everything instead.
+On startup the index is loaded (and missing embeddings backfilled) in the
+background. Every VECTOR_TRAIN_INTERVAL_S it drops the slots of traces
+removed by retention once they are a quarter of the index, and retrains
+once it has doubled in size since the last training.
+
+classifier.py reuses the category of a near-duplicate (similarity at least
+NEAR_DUPLICATE_THRESHOLD) before calling the LLM.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import bindparam, select, update
+
+from database import SessionLocal
+from models import Category, Trace
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "128"))
+VECTOR_NPROBE = int(os.environ.get("VECTOR_NPROBE", "8"))
+VECTOR_BRUTE_FORCE_MAX = int(os.environ.get("VECTOR_BRUTE_FORCE_MAX", "20000"))
+# 0 disables reusing near-duplicate categories.
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.95"))
+VECTOR_TRAIN_INTERVAL_S = float(os.environ.get("VECTOR_TRAIN_INTERVAL_S", "300"))
+
+_SCALE = 127.0
+_WORD = re.compile(r"[a-z0-9]+")
+_DIGIT = re.compile(r"\d")
+CATEGORIES = list(Category)
+_PENDING = CATEGORIES.index(Category.PENDING)
+# Category code of rows whose trace was removed.
+_REMOVED = -1
+
+
+def _features(text: str) -> list[str]:
+    # Digits are folded together so "$29" and "$49" look alike.
+    words = _WORD.findall(_DIGIT.sub("0", text.lower()))
+    joined = f" {' '.join(words)} "
+    features = [joined[i : i + n] for n in (3, 4) for i in range(len(joined) - n + 1)]
+    features += ["w:" + word for word in words]
+    features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    return features
+
+
+def encode(text: str) -> np.ndarray:
+    """Embed a message as an int8 vector of length EMBEDDING_DIM."""
+    hashes = np.fromiter(
+        (zlib.crc32(feature.encode()) for feature in _features(text)), dtype=np.uint32
+    )
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+    vector = np.bincount(hashes % EMBEDDING_DIM, weights=signs, minlength=EMBEDDING_DIM)
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return np.clip(np.rint(vector * _SCALE), -127, 127).astype(np.int8)
+
+
+def to_bytes(vector: np.ndarray) -> bytes:
+    return vector.astype(np.int8).tobytes()
+
+
+def from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.int8)
+
+
+def as_unit(vectors: np.ndarray) -> np.ndarray:
+    """int8 vectors (one per row) as float32 vectors of length ~1."""
+    return vectors.astype(np.float32) / _SCALE
+
+
+def kmeans(points: np.ndarray, k: int, iterations: int = 8, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Spherical k-means on unit float32 rows; returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(points)))
+    centroids = points[rng.choice(len(points), k, replace=False)].copy()
+    assignment = np.zeros(len(points), dtype=np.int32)
+    for _ in range(iterations):
+        assignment = assign(points, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, points)
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        # Reseed empty clusters from random points.
+        sums[empty] = points[rng.choice(len(points), int(empty.sum()))]
+        norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = sums / np.maximum(norms, 1e-12)[:, None]
+    return centroids.astype(np.float32), assign(points, centroids)
+
+
+def assign(points: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    """Index of the most similar centroid for each row of points (int8 or unit float32)."""
+    out = np.empty(len(points), dtype=np.int32)
+    for start in range(0, len(points), chunk):
+        block = points[start : start + chunk]
+        if block.dtype == np.int8:
+            block = as_unit(block)
+        out[start : start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def _scores(vectors: np.ndarray, rows: np.ndarray, query: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Cosine similarity of query to vectors[rows], converting a chunk at a time."""
+    out = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), chunk):
+        out[start : start + chunk] = as_unit(vectors[rows[start : start + chunk]]) @ query
+    return out
+
+
+class VectorIndex:
+    """In-memory IVF index of trace embeddings with their categories."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.nprobe = VECTOR_NPROBE
+        self.ready = False
+        self.reused = 0
+        self.trainings = 0
+        # Bumped whenever rows are renumbered.
+        self.generation = 0
+        self._loading = False
+        self._task: asyncio.Task | None = None
+        self._lock = threading.Lock()
+        self._size = 0
+        self._removed = 0
+        self._rows: dict[str, int] = {}
+        self._vectors = np.zeros((1024, dim), dtype=np.int8)
+        self._ids = np.zeros(1024, dtype="S36")
+        self._categories = np.zeros(1024, dtype=np.int8)
+        self._centroids: np.ndarray | None = None
+        self._lists: list[np.ndarray] = []
+        self._unlisted: list[list[int]] = []
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return self._size - self._removed
+
+    def add(self, ids: list[str], vectors: np.ndarray, categories: list[Category]) -> None:
+        with self._lock:
+            # load() and ingest can both hand over a trace committed mid-load.
+            fresh = [i for i, trace_id in enumerate(ids) if trace_id not in self._rows]
+            if len(fresh) < len(ids):
+                ids = [ids[i] for i in fresh]
+                vectors = vectors[fresh]
+                categories = [categories[i] for i in fresh]
+            if not ids:
+                return
+            needed = self._size + len(ids)
+            if needed > len(self._ids):
+                capacity = max(needed, 2 * len(self._ids))
+                self._vectors = np.resize(self._vectors, (capacity, self.dim))
+                self._ids = np.resize(self._ids, capacity)
+                self._categories = np.resize(self._categories, capacity)
+            rows = slice(self._size, needed)
+            self._vectors[rows] = vectors
+            self._ids[rows] = [trace_id.encode() for trace_id in ids]
+            self._categories[rows] = [CATEGORIES.index(category) for category in categories]
+            self._rows.update(zip(ids, range(self._size, needed)))
+            if self._centroids is not None:
+                lists = assign(vectors, self._centroids)
+                for row, list_id in zip(range(self._size, needed), lists):
+                    self._unlisted[list_id].append(row)
+            self._size = needed
+
+    def add_traces(self, traces) -> None:
+        """Index committed traces, once load() has started (it picks up earlier ones)."""
+        if self._loading or self.ready:
+            self.add(
+                [trace.id for trace in traces],
+                np.frombuffer(b"".join(trace.embedding for trace in traces), dtype=np.int8).reshape(-1, self.dim),
+                [trace.category for trace in traces],
+            )
+
+    def set_category(self, trace_id: str, category: Category) -> None:
+        with self._lock:
+            row = self._rows.get(trace_id)
+            if row is not None:
+                self._categories[row] = CATEGORIES.index(category)
+
+    def remove(self, ids: list[str]) -> None:
+        """Stop returning these traces; compact() later frees their slots."""
+        with self._lock:
+            for trace_id in ids:
+                row = self._rows.pop(trace_id, None)
+                if row is not None:
+                    self._categories[row] = _REMOVED
+                    self._removed += 1
+
+    def needs_compaction(self) -> bool:
+        return self._removed > max(1024, self._size // 4)
+
+    def compact(self) -> None:
+        """Drop removed rows, renumbering the rest and their IVF lists."""
+        with self._lock:
+            keep = np.nonzero(self._categories[: self._size] != _REMOVED)[0]
+            renumber = np.full(self._size, -1, dtype=np.int64)
+            renumber[keep] = np.arange(len(keep))
+            capacity = max(1024, 2 * len(keep))
+            self._vectors = np.resize(self._vectors[keep], (capacity, self.dim))
+            self._ids = np.resize(self._ids[keep], capacity)
+            self._categories = np.resize(self._categories[keep], capacity)
+            self._rows = {trace_id.decode(): row for row, trace_id in enumerate(self._ids[: len(keep)])}
+            if self._centroids is not None:
+                for list_id, rows in enumerate(self._lists):
+                    if self._unlisted[list_id]:
+                        rows = np.concatenate([rows, np.array(self._unlisted[list_id], dtype=np.int64)])
+                    rows = renumber[rows]
+                    self._lists[list_id] = rows[rows >= 0]
+                    self._unlisted[list_id] = []
+            self._trained_size = min(self._trained_size, len(keep))
+            self._size, self._removed = len(keep), 0
+            self.generation += 1
+
+    def train(self) -> None:
+        """(Re)build the coarse quantizer; brute force is used until then."""
+        with self._lock:
+            size = self._size
+            generation = self.generation
+            # Rows below size are only renumbered by compact(), which copies.
+            vectors = self._vectors[:size]
+        if size <= VECTOR_BRUTE_FORCE_MAX:
+            return
+        nlist = int(min(4096, max(16, np.sqrt(size))))
+        rng = np.random.default_rng(0)
+        sample = as_unit(vectors[np.sort(rng.choice(size, min(size, nlist * 32), replace=False))])
+        centroids, _ = kmeans(sample, nlist)
+        assignment = assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        lists = [order[bounds[i] : bounds[i + 1]].astype(np.int64) for i in range(nlist)]
+        with self._lock:
+            if self.generation != generation:
+                return
+            unlisted = [[] for _ in range(nlist)]
+            if self._size > size:
+                # Rows added while training.
+                late = assign(self._vectors[size : self._size], centroids)
+                for row, list_id in zip(range(size, self._size), late):
+                    unlisted[list_id].append(row)
+            self._centroids, self._lists, self._unlisted = centroids, lists, unlisted
+            self._trained_size = size
+            self.trainings += 1
+
+    def needs_training(self) -> bool:
+        return len(self) > VECTOR_BRUTE_FORCE_MAX and len(self) > 2 * self._trained_size
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.arange(self._size)
+        probes = np.argsort(self._centroids @ query)[-self.nprobe :]
+        parts = []
+        for list_id in probes:
+            if self._unlisted[list_id]:
+                self._lists[list_id] = np.concatenate(
+                    [self._lists[list_id], np.array(self._unlisted[list_id], dtype=np.int64)]
+                )
+                self._unlisted[list_id] = []
+            parts.append(self._lists[list_id])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def search(
+        self, vector: np.ndarray, k: int = 10, skip_pending: bool = False
+    ) -> list[tuple[str, Category, float]]:
+        """The k most similar indexed traces as (id, category, similarity)."""
+        query = as_unit(vector[None, :])[0]
+        with self._lock:
+            rows = self._candidates(query)
+            if rows.size:
+                codes = self._categories[rows]
+                keep = codes != _REMOVED
+                if skip_pending:
+                    keep &= codes != _PENDING
+                rows = rows[keep]
+            if not rows.size:
+                return []
+            scores = _scores(self._vectors, rows, query)
+            top = np.argsort(scores)[::-1][:k]
+            # int8 rounding can push a self-match just past 1.
+            return [
+                (
+                    self._ids[rows[i]].decode(),
+                    CATEGORIES[self._categories[rows[i]]],
+                    min(1.0, float(scores[i])),
+                )
+                for i in top
+            ]
+
+    def near_duplicate(self, user_message: str) -> Category | None:
+        """Category of an already classified trace nearly identical to this one."""
+        if NEAR_DUPLICATE_THRESHOLD <= 0 or not self.ready:
+            return None
+        matches = self.search(encode(user_message), k=1, skip_pending=True)
+        if matches and matches[0][2] >= NEAR_DUPLICATE_THRESHOLD:
+            self.reused += 1
+            return matches[0][1]
+        return None
+
+    def load(self) -> None:
+        """Index every stored embedding, backfilling traces that lack one."""
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        self._loading = True
+        db = SessionLocal()
+        try:
+            missing = (
+                db.query(Trace.id, Trace.user_message)
+                .filter(Trace.embedding.is_(None), Trace.timestamp < started_at)
+                .yield_per(5000)
+            )
+            batch = []
+            for trace_id, user_message in missing:
+                batch.append({"trace_id": trace_id, "embedding": to_bytes(encode(user_message))})
+                if len(batch) == 5000:
+                    _write_embeddings(batch)
+                    batch = []
+            if batch:
+                _write_embeddings(batch)
+
+            rows = db.execute(
+                select(Trace.id, Trace.category, Trace.embedding)
+                .filter(Trace.embedding.is_not(None), Trace.timestamp < started_at)
+                .execution_options(yield_per=20000)
+            )
+            for partition in rows.partitions():
+                self.add(
+                    [row.id for row in partition],
+                    np.frombuffer(b"".join(row.embedding for row in partition), dtype=np.int8).reshape(-1, self.dim),
+                    [row.category for row in partition],
+                )
+        finally:
+            db.close()
+        self.train()
+        self.ready = True
+        self._loading = False
+        logger.info("Indexed %d trace embeddings in %.1fs", len(self), time.perf_counter() - started)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception:
+            self._loading = False
+            logger.exception("Failed to load the vector index")
+            return
+        while True:
+            await asyncio.sleep(VECTOR_TRAIN_INTERVAL_S)
+            try:
+                if self.needs_compaction():
+                    await asyncio.to_thread(self.compact)
+                if self.needs_training():
+                    await asyncio.to_thread(self.train)
+            except Exception:
+                logger.exception("Failed to maintain the vector index")
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "removed": self._removed,
+            "lists": len(self._lists),
+            "ready": int(self.ready),
+            "trainings": self.trainings,
+            "near_duplicates_reused": self.reused,
+        }
+
+
+def _write_embeddings(batch: list[dict]) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Trace.__table__)
+            .where(Trace.__table__.c.id == bindparam("trace_id"))
+            .values(embedding=bindparam("embedding")),
+            batch,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+index = VectorIndex()
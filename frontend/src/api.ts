@@ -9,21 +9,46 @@ export interface Trace {
     | "Refund"
     | "Account Access"
     | "Cancellation"
-    | "General Inquiry";
+    | "General Inquiry"
+    | "Pending";
   timestamp: string;
   response_time_ms: number;
+  time_to_first_token_ms: number | null;
+  // Only set on search results; hits are wrapped in <mark>…</mark>.
+  score?: number | null;
+  snippet?: string | null;
+}
+
+export interface TracePage {
+  items: Trace[];
+  next_cursor: string | null;
+}
+
+export interface LatencyPercentiles {
+  p50: number;
+  p95: number;
+  p99: number;
+}
+
+export interface HistogramBucket {
+  le_ms: number | null;
+  count: number;
 }
 
 export interface CategoryStat {
   category: string;
   count: number;
   percentage: number;
+  latency: LatencyPercentiles | null;
 }
 
 export interface Analytics {
   total_traces: number;
   by_category: CategoryStat[];
   avg_response_time_ms: number;
+  pending_traces: number;
+  latency: LatencyPercentiles | null;
+  latency_histogram: HistogramBucket[];
 }
 
 export async function sendChat(
@@ -38,6 +63,53 @@ export async function sendChat(
   return res.json();
 }
 
+export interface ChatStreamResult {
+  response: string;
+  response_time_ms: number;
+  time_to_first_token_ms: number | null;
+  trace_id?: string;
+}
+
+// Streams a chatbot response over SSE, calling onToken for each text delta.
+// With persist, the server saves the finished conversation as a trace.
+export async function streamChat(
+  message: string,
+  onToken: (token: string) => void,
+  persist = true
+): Promise<ChatStreamResult> {
+  const res = await fetch(`${BASE}/chat/stream?persist=${persist}`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ message }),
+  });
+  if (!res.ok || !res.body) throw new Error(`Chat failed: ${res.statusText}`);
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      const payload = JSON.parse(data);
+      if (event === "token") onToken(payload.token);
+      else if (event === "done") return payload;
+      else if (event === "error") throw new Error(payload.detail);
+    }
+  }
+  throw new Error("Chat stream ended unexpectedly");
+}
+
 export async function postTrace(
   user_message: string,
   bot_response: string,
@@ -52,17 +124,103 @@ export async function postTrace(
   return res.json();
 }
 
-export async function getTraces(category?: string): Promise<Trace[]> {
-  const url = category
-    ? `${BASE}/traces?category=${encodeURIComponent(category)}`
-    : `${BASE}/traces`;
-  const res = await fetch(url);
+export interface TraceQuery {
+  category?: string;
+  q?: string;
+  cursor?: string | null;
+  limit?: number;
+}
+
+export async function getTraces({
+  category,
+  q,
+  cursor,
+  limit = 50,
+}: TraceQuery = {}): Promise<TracePage> {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (category) params.set("category", category);
+  if (q) params.set("q", q);
+  if (cursor) params.set("cursor", cursor);
+  const res = await fetch(`${BASE}/traces?${params}`);
   if (!res.ok) throw new Error(`Fetch traces failed: ${res.statusText}`);
   return res.json();
 }
 
-export async function getAnalytics(): Promise<Analytics> {
+export interface AnalyticsDelta {
+  category: string;
+  count: number;
+  latency_sum_ms: number;
+}
+
+// An `analytics` event: the deltas of one write and the traces version it
+// committed (the same counter as the /analytics ETag).
+export interface AnalyticsEvent {
+  version: number;
+  deltas: AnalyticsDelta[];
+}
+
+export interface AnalyticsSnapshot {
+  analytics: Analytics;
+  // Events at or below this version are already counted in analytics.
+  version: number;
+}
+
+// Folds pushed analytics deltas into a snapshot. Percentiles and the
+// histogram can't be derived from deltas and stay as last fetched.
+export function applyAnalyticsDeltas(
+  analytics: Analytics,
+  deltas: AnalyticsDelta[]
+): Analytics {
+  let total = analytics.total_traces;
+  let latencySum = analytics.avg_response_time_ms * total;
+  let pending = analytics.pending_traces;
+  const counts = new Map(analytics.by_category.map((c) => [c.category, c]));
+
+  for (const d of deltas) {
+    total += d.count;
+    latencySum += d.latency_sum_ms;
+    if (d.category === "Pending") {
+      pending += d.count;
+      continue;
+    }
+    const prev = counts.get(d.category);
+    counts.set(d.category, {
+      category: d.category,
+      count: (prev?.count ?? 0) + d.count,
+      percentage: 0,
+      latency: prev?.latency ?? null,
+    });
+  }
+
+  const classified = total - pending;
+  const by_category = [...counts.values()]
+    .filter((c) => c.count > 0)
+    .map((c) => ({
+      ...c,
+      // Everything can still be Pending, e.g. right after async ingest.
+      percentage:
+        classified > 0 ? Math.round((c.count / classified) * 1000) / 10 : 0,
+    }));
+
+  return {
+    ...analytics,
+    total_traces: total,
+    pending_traces: pending,
+    by_category,
+    avg_response_time_ms: total > 0 ? latencySum / total : 0,
+  };
+}
+
+// Server-sent trace/analytics updates; EventSource resumes with
+// Last-Event-ID after a reconnect.
+export function subscribeEvents(): EventSource {
+  return new EventSource(`${BASE}/events`);
+}
+
+export async function getAnalytics(): Promise<AnalyticsSnapshot> {
   const res = await fetch(`${BASE}/analytics`);
   if (!res.ok) throw new Error(`Fetch analytics failed: ${res.statusText}`);
-  return res.json();
+  // The ETag is W/"<version>".
+  const version = Number(res.headers.get("ETag")?.match(/\d+/)?.[0] ?? 0);
+  return { analytics: await res.json(), version };
 }
@@ -28,6 +28,10 @@ interface Props {
   analytics: Analytics;
 }
 
+function formatMs(ms: number) {
+  return ms < 1000 ? `${Math.round(ms)}ms` : `${(ms / 1000).toFixed(1)}s`;
+}
+
 export default function AnalyticsPanel({ analytics }: Props) {
   const chartData = analytics.by_category.map((c) => ({
     name: c.category,
@@ -59,7 +63,11 @@ export default function AnalyticsPanel({ analytics }: Props) {
           <div className="text-3xl font-bold text-slate-900">
             {analytics.total_traces}
           </div>
-          <div className="text-xs text-slate-400 mt-0.5">conversations logged</div>
+          <div className="text-xs text-slate-400 mt-0.5">
+            conversations logged
+            {analytics.pending_traces > 0 &&
+              ` · ${analytics.pending_traces} awaiting classification`}
+          </div>
         </div>
 
         <div className="bg-white rounded-xl border border-slate-200 p-4">
@@ -68,11 +76,15 @@ export default function AnalyticsPanel({ analytics }: Props) {
             Avg Response Time
           </div>
           <div className="text-3xl font-bold text-slate-900">
-            {analytics.avg_response_time_ms < 1000
-              ? `${Math.round(analytics.avg_response_time_ms)}ms`
-              : `${(analytics.avg_response_time_ms / 1000).toFixed(1)}s`}
+            {formatMs(analytics.avg_response_time_ms)}
+          </div>
+          <div className="text-xs text-slate-400 mt-0.5">
+            per chatbot response
+            {analytics.latency &&
+              ` · p50 ${formatMs(analytics.latency.p50)} · p95 ${formatMs(
+                analytics.latency.p95
+              )} · p99 ${formatMs(analytics.latency.p99)}`}
           </div>
-          <div className="text-xs text-slate-400 mt-0.5">per chatbot response</div>
         </div>
       </div>
 
@@ -1,6 +1,6 @@
 import { useState, useRef, useEffect } from "react";
 import { Send, Bot, User, Loader2, Eye } from "lucide-react";
-import { sendChat, postTrace } from "../api";
+import { streamChat } from "../api";
 
 interface Message {
   role: "user" | "bot";
@@ -18,6 +18,8 @@ export default function Chatbot() {
   ]);
   const [input, setInput] = useState("");
   const [loading, setLoading] = useState(false);
+  // True once the first token of the reply has arrived.
+  const [streaming, setStreaming] = useState(false);
   const bottomRef = useRef<HTMLDivElement>(null);
 
   useEffect(() => {
@@ -32,24 +34,33 @@ export default function Chatbot() {
     setMessages((prev) => [...prev, { role: "user", content: text }]);
     setLoading(true);
 
+    let started = false;
     try {
-      const { response, response_time_ms } = await sendChat(text);
-
-      setMessages((prev) => [...prev, { role: "bot", content: response }]);
-
-      // Save trace in background
-      postTrace(text, response, response_time_ms).catch(console.error);
+      // The server saves the trace once the stream completes (persist=true).
+      await streamChat(text, (token) => {
+        if (!started) {
+          started = true;
+          setStreaming(true);
+          setMessages((prev) => [...prev, { role: "bot", content: token }]);
+          return;
+        }
+        setMessages((prev) => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: last.content + token }];
+        });
+      });
     } catch {
-      setMessages((prev) => [
-        ...prev,
-        {
-          role: "bot",
-          content:
-            "Sorry, I'm having trouble responding right now. Please try again.",
-        },
-      ]);
+      const apology: Message = {
+        role: "bot",
+        content:
+          "Sorry, I'm having trouble responding right now. Please try again.",
+      };
+      setMessages((prev) =>
+        started ? [...prev.slice(0, -1), apology] : [...prev, apology]
+      );
     } finally {
       setLoading(false);
+      setStreaming(false);
     }
   }
 
@@ -103,7 +114,7 @@ export default function Chatbot() {
           </div>
         ))}
 
-        {loading && (
+        {loading && !streaming && (
           <div className="flex gap-3">
             <div className="w-7 h-7 rounded-full bg-brand-600 flex items-center justify-center shrink-0">
               <Bot className="w-4 h-4 text-white" />
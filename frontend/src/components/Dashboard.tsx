@@ -1,6 +1,14 @@
-import { useState, useEffect, useCallback } from "react";
-import { RefreshCw } from "lucide-react";
-import { getTraces, getAnalytics, Trace, Analytics } from "../api";
+import { useState, useEffect, useCallback, useRef } from "react";
+import { RefreshCw, Search } from "lucide-react";
+import {
+  applyAnalyticsDeltas,
+  getTraces,
+  getAnalytics,
+  subscribeEvents,
+  Trace,
+  Analytics,
+  AnalyticsEvent,
+} from "../api";
 import AnalyticsPanel from "./Analytics";
 import TraceTable from "./TraceTable";
 
@@ -15,36 +23,123 @@ const CATEGORIES = [
 
 export default function Dashboard() {
   const [traces, setTraces] = useState<Trace[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [analytics, setAnalytics] = useState<Analytics | null>(null);
   const [selectedCategory, setSelectedCategory] = useState("All");
+  const [searchInput, setSearchInput] = useState("");
+  const [search, setSearch] = useState("");
   const [loading, setLoading] = useState(true);
   const [refreshing, setRefreshing] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
+  // Traces version the analytics snapshot already counts (its ETag).
+  const analyticsVersion = useRef(0);
+  // Analytics events received while a snapshot is being fetched; the ones
+  // newer than the snapshot are replayed onto it.
+  const fetchesInFlight = useRef(0);
+  const eventsDuringFetch = useRef<AnalyticsEvent[]>([]);
+
   const load = useCallback(
     async (silent = false) => {
       if (!silent) setLoading(true);
       else setRefreshing(true);
       setError(null);
+      fetchesInFlight.current += 1;
       try {
         const cat = selectedCategory === "All" ? undefined : selectedCategory;
-        const [t, a] = await Promise.all([getTraces(cat), getAnalytics()]);
-        setTraces(t);
-        setAnalytics(a);
+        const [t, a] = await Promise.all([
+          getTraces({ category: cat, q: search || undefined }),
+          getAnalytics(),
+        ]);
+        setTraces(t.items);
+        setNextCursor(t.next_cursor);
+        analyticsVersion.current = a.version;
+        setAnalytics(
+          eventsDuringFetch.current
+            .filter((event) => event.version > a.version)
+            .reduce((acc, event) => applyAnalyticsDeltas(acc, event.deltas), a.analytics)
+        );
       } catch (e) {
         setError(e instanceof Error ? e.message : "Failed to load data");
       } finally {
+        fetchesInFlight.current -= 1;
+        if (fetchesInFlight.current === 0) eventsDuringFetch.current = [];
         setLoading(false);
         setRefreshing(false);
       }
     },
-    [selectedCategory]
+    [selectedCategory, search]
   );
 
   useEffect(() => {
     load();
   }, [load]);
 
+  // The event stream outlives filter and search changes; handlers read the
+  // current ones through refs.
+  const loadRef = useRef(load);
+  const filters = useRef({ selectedCategory, search });
+  useEffect(() => {
+    loadRef.current = load;
+    filters.current = { selectedCategory, search };
+  }, [load, selectedCategory, search]);
+
+  // Apply pushed changes locally instead of refetching everything.
+  useEffect(() => {
+    const source = subscribeEvents();
+
+    source.addEventListener("trace", (e) => {
+      const trace: Trace = JSON.parse((e as MessageEvent).data);
+      const { selectedCategory, search } = filters.current;
+      if (search) return; // can't tell whether it matches the query
+      if (selectedCategory !== "All" && trace.category !== selectedCategory) return;
+      setTraces((prev) =>
+        prev.some((t) => t.id === trace.id) ? prev : [trace, ...prev]
+      );
+    });
+
+    source.addEventListener("trace_updated", (e) => {
+      const { id, category } = JSON.parse((e as MessageEvent).data);
+      setTraces((prev) =>
+        prev.map((t) => (t.id === id ? { ...t, category } : t))
+      );
+    });
+
+    source.addEventListener("analytics", (e) => {
+      const event: AnalyticsEvent = JSON.parse((e as MessageEvent).data);
+      if (fetchesInFlight.current > 0) eventsDuringFetch.current.push(event);
+      // Already counted by the snapshot.
+      if (event.version <= analyticsVersion.current) return;
+      setAnalytics((prev) =>
+        prev ? applyAnalyticsDeltas(prev, event.deltas) : prev
+      );
+    });
+
+    source.addEventListener("resync", () => loadRef.current(true));
+
+    return () => source.close();
+  }, []);
+
+  async function loadMore() {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const cat = selectedCategory === "All" ? undefined : selectedCategory;
+      const page = await getTraces({
+        category: cat,
+        q: search || undefined,
+        cursor: nextCursor,
+      });
+      setTraces((prev) => [...prev, ...page.items]);
+      setNextCursor(page.next_cursor);
+    } catch (e) {
+      setError(e instanceof Error ? e.message : "Failed to load data");
+    } finally {
+      setLoadingMore(false);
+    }
+  }
+
   return (
     <div className="max-w-7xl mx-auto px-6 py-8 space-y-6">
       {/* Header row */}
@@ -80,6 +175,21 @@ export default function Dashboard() {
 
       {/* Category filter */}
       <div className="flex items-center gap-2 flex-wrap">
+        <form
+          onSubmit={(e) => {
+            e.preventDefault();
+            setSearch(searchInput.trim());
+          }}
+          className="relative mr-2"
+        >
+          <Search className="w-3.5 h-3.5 text-slate-400 absolute left-2.5 top-1/2 -translate-y-1/2" />
+          <input
+            value={searchInput}
+            onChange={(e) => setSearchInput(e.target.value)}
+            placeholder="Search messages…"
+            className="pl-8 pr-3 py-1 w-56 rounded-full border border-slate-200 bg-white text-xs focus:outline-none focus:ring-2 focus:ring-brand-500 focus:border-transparent placeholder-slate-400"
+          />
+        </form>
         <span className="text-xs font-medium text-slate-500 uppercase tracking-wide">
           Filter:
         </span>
@@ -100,6 +210,18 @@ export default function Dashboard() {
 
       {/* Trace table */}
       <TraceTable traces={traces} loading={loading} />
+
+      {nextCursor && !loading && (
+        <div className="flex justify-center">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="px-4 py-1.5 text-sm font-medium text-slate-600 bg-white border border-slate-200 rounded-lg hover:bg-slate-50 disabled:opacity-50 transition-colors"
+          >
+            {loadingMore ? "Loading…" : "Load more"}
+          </button>
+        </div>
+      )}
     </div>
   );
 }
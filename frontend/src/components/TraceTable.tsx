@@ -8,12 +8,37 @@ const CATEGORY_BADGE: Record<string, string> = {
   "Account Access": "bg-emerald-100 text-emerald-700",
   Cancellation: "bg-red-100 text-red-700",
   "General Inquiry": "bg-blue-100 text-blue-700",
+  Pending: "bg-slate-100 text-slate-500",
 };
 
 function truncate(text: string, max = 80) {
   return text.length > max ? text.slice(0, max) + "…" : text;
 }
 
+// Render a search snippet, turning <mark>…</mark> into highlights without
+// injecting any HTML from the trace itself.
+function Snippet({ text }: { text: string }) {
+  const parts = text.split(/(<mark>|<\/mark>)/);
+  let marked = false;
+  return (
+    <>
+      {parts.map((part, i) => {
+        if (part === "<mark>" || part === "</mark>") {
+          marked = part === "<mark>";
+          return null;
+        }
+        return marked ? (
+          <mark key={i} className="bg-amber-100 text-slate-900 rounded px-0.5">
+            {part}
+          </mark>
+        ) : (
+          <Fragment key={i}>{part}</Fragment>
+        );
+      })}
+    </>
+  );
+}
+
 function formatTime(iso: string) {
   const d = new Date(iso + "Z"); // treat as UTC
   return d.toLocaleString(undefined, {
@@ -89,7 +114,11 @@ export default function TraceTable({ traces, loading }: Props) {
                 </td>
                 <td className="px-4 py-3 text-slate-700 max-w-[200px]">
                   <span className="line-clamp-2">
-                    {truncate(trace.user_message)}
+                    {trace.snippet ? (
+                      <Snippet text={trace.snippet} />
+                    ) : (
+                      truncate(trace.user_message)
+                    )}
                   </span>
                 </td>
                 <td className="px-4 py-3 text-slate-500 hidden md:table-cell max-w-[220px]">